@@ -0,0 +1,57 @@
+"""Сравнение последовательной и параллельной загрузки VFS из одного архива"""
+import argparse
+import contextlib
+import io
+import time
+
+import stepn1
+
+
+def _vfs_snapshot() -> dict:
+    """Плоское представление загруженной VFS для сравнения результатов"""
+    result = {}
+    stack = [("", stepn1.VFS["root"])]
+    while stack:
+        prefix, node = stack.pop()
+        for name, child in node.children.items():
+            path = prefix + "/" + name
+            if isinstance(child, stepn1.DirNode):
+                result[path + "/"] = None
+                stack.append((path, child))
+            else:
+                result[path] = (bytes(stepn1._file_data(child)), stepn1._file_is_text(child))
+    return result
+
+
+def time_load(zip_path: str, jobs: int, repeat: int) -> tuple[float, dict]:
+    """Лучшее время из repeat загрузок и снимок получившейся VFS"""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            ok = stepn1.load_vfs_from_zip(zip_path, jobs=jobs)
+            elapsed = time.perf_counter() - start
+        if not ok:
+            raise SystemExit(f"Не удалось загрузить {zip_path}")
+        best = elapsed if best is None else min(best, elapsed)
+    return best, _vfs_snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер загрузки VFS: последовательно и в пуле потоков")
+    parser.add_argument("archive", help="Путь к ZIP-архиву")
+    parser.add_argument("-j", "--jobs", type=int, nargs="+", default=[2, 4, 8], help="Числа потоков для сравнения")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Число повторов каждого замера")
+    args = parser.parse_args()
+
+    serial_time, reference = time_load(args.archive, 1, args.repeat)
+    print(f"{'jobs':>6} {'time, s':>10} {'speedup':>8}  same VFS")
+    print(f"{1:>6} {serial_time:>10.3f} {1.0:>8.2f}  yes")
+    for jobs in args.jobs:
+        elapsed, snapshot = time_load(args.archive, jobs, args.repeat)
+        same = "yes" if snapshot == reference else "NO"
+        print(f"{jobs:>6} {elapsed:>10.3f} {serial_time / elapsed:>8.2f}  {same}")
+
+
+if __name__ == "__main__":
+    main()
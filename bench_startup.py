@@ -0,0 +1,75 @@
+"""Бенчмарк запуска эмулятора: время от старта интерпретатора до первого приглашения.
+
+Пример:
+    python bench_startup.py -v multilevel.zip -r 30 -o startup_output.txt
+
+Каждый вариант запускается в отдельном процессе; замер заканчивается, когда в stdout
+появляется приглашение REPL. Каждая строка результата - JSON-объект со временем в миллисекундах.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+EMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stepn1.py")
+PROMPT = b"]$ "
+
+
+def time_to_prompt(args: list[str]) -> float:
+    """Запускает эмулятор и ждёт первого приглашения; время в миллисекундах"""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, *args], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    seen = b""
+    while PROMPT not in seen:
+        chunk = os.read(proc.stdout.fileno(), 65536)
+        if not chunk:
+            proc.wait()
+            raise RuntimeError(f"эмулятор завершился без приглашения: {' '.join(args)}")
+        seen = seen[-len(PROMPT):] + chunk
+    elapsed = (time.perf_counter() - start) * 1000
+    proc.communicate(b"exit\n")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запуска эмулятора до первого приглашения")
+    parser.add_argument("-v", "--vfs", default=None, help="ZIP-архив для вариантов с загрузкой VFS")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="Число запусков каждого варианта")
+    parser.add_argument("-o", "--output", default=None, help="Файл для результатов (JSON Lines)")
+    args = parser.parse_args()
+    vfs = args.vfs and os.path.abspath(args.vfs)
+
+    variants = {
+        "python": ["-c", "print('[x]$ ')"],
+        "bare": [EMULATOR],
+        "bare-quiet": [EMULATOR, "--quiet"],
+        "module-quiet": ["-m", "stepn1", "--quiet"],
+    }
+    if vfs:
+        variants["vfs"] = [EMULATOR, "-v", vfs]
+        variants["vfs-quiet"] = [EMULATOR, "-v", vfs, "--quiet"]
+        variants["vfs-module-quiet"] = ["-m", "stepn1", "-v", vfs, "--quiet"]
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    # Запуск с -m ищет модуль в текущей папке
+    os.chdir(os.path.dirname(EMULATOR))
+    for name, cmd in variants.items():
+        timings = sorted(time_to_prompt(cmd) for _ in range(args.repeat))
+        out.write(json.dumps({
+            "variant": name,
+            "runs": len(timings),
+            "mean_ms": round(statistics.fmean(timings), 2),
+            "p50_ms": round(timings[len(timings) // 2], 2),
+            "min_ms": round(timings[0], 2),
+        }, ensure_ascii=False) + "\n")
+        out.flush()
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
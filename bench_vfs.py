@@ -0,0 +1,174 @@
+"""Бенчмарк команд VFS на синтетических архивах.
+
+Пример:
+    python bench_vfs.py --files 1000 10000 100000 --depth 3 --fanout 8 -o bench_output.txt
+
+Каждая строка результата - JSON-объект с параметрами архива, командой и временем в микросекундах.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+import stepn1
+
+
+class _NullOutput:
+    """Поглощает вывод команд во время замеров"""
+
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def _directory_paths(depth: int, fanout: int) -> list[str]:
+    """Пути папок дерева заданной глубины и ветвления (без корня)"""
+    levels = [[""]]
+    for _ in range(depth):
+        levels.append([f"{parent}d{i}/" for parent in levels[-1] for i in range(fanout)])
+    return [path for level in levels[1:] for path in level]
+
+
+def generate_archive(path: str, files: int, depth: int, fanout: int, file_size: int,
+                     binary_ratio: float, empty_dirs: int = 100, seed: int = 0) -> dict:
+    """Создаёт синтетический архив и возвращает пути, на которых удобно мерить команды"""
+    rng = random.Random(seed)
+    directories = _directory_paths(depth, fanout)
+    leaves = [d for d in directories if d.count('/') == depth] or [""]
+    line = b"synthetic line \xd0\xbf\xd1\x80\xd0\xb8\xd0\xb2\xd0\xb5\xd1\x82\n"
+    text = (line * (file_size // len(line) + 1))[:file_size]
+    samples = {"text": None, "binary": None}
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for directory in directories:
+            zip_ref.writestr(directory, b"")
+        for i in range(empty_dirs):
+            zip_ref.writestr(f"empty{i}/", b"")
+        for i in range(files):
+            name = f"{leaves[i % len(leaves)]}f{i}"
+            if rng.random() < binary_ratio:
+                name += ".bin"
+                zip_ref.writestr(name, rng.randbytes(file_size))
+                samples["binary"] = samples["binary"] or name
+            else:
+                name += ".txt"
+                zip_ref.writestr(name, text)
+                samples["text"] = samples["text"] or name
+
+    return {
+        "leaf": "/" + leaves[0],
+        "top": "/" + (directories[0] if directories else ""),
+        "text": samples["text"] and "/" + samples["text"],
+        "binary": samples["binary"] and "/" + samples["binary"],
+        "empty_dirs": empty_dirs,
+    }
+
+
+def _time_ops(lines, repeat: int) -> list[float]:
+    """Время каждого выполнения последовательности команд, в микросекундах"""
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for line in lines(i):
+            stepn1.execute_line(line)
+        timings.append((time.perf_counter() - start) * 1e6)
+    return timings
+
+
+def bench_archive(zip_path: str, samples: dict, mode: str, repeat: int,
+                  grep_jobs: list[int] = ()) -> list[dict]:
+    """Замеряет загрузку и команды на одном архиве"""
+    results = []
+
+    def record(op: str, timings: list[float]) -> None:
+        ordered = sorted(timings)
+        results.append({
+            "op": op,
+            "runs": len(timings),
+            "mean_us": round(statistics.fmean(timings), 2),
+            "p50_us": round(ordered[len(ordered) // 2], 2),
+            "min_us": round(ordered[0], 2),
+        })
+
+    load_args = {"lazy": mode == "lazy", "use_mmap": mode == "mmap"}
+    load_timings = []
+    for _ in range(max(1, repeat // 10)):
+        start = time.perf_counter()
+        stepn1.load_vfs_from_zip(zip_path, **load_args)
+        load_timings.append((time.perf_counter() - start) * 1e6)
+    record("load", load_timings)
+
+    leaf, top = samples["leaf"], samples["top"]
+    record("ls", _time_ops(lambda i: [f"cd {leaf}", "ls"], repeat))
+    record("cd", _time_ops(lambda i: [f"cd {leaf}", "cd /"], repeat))
+    runs = max(1, repeat // 10)
+    record("ls-R", _time_ops(lambda i: ["ls -R /"], runs))
+    record("find", _time_ops(lambda i: ["find / -name '*.txt'"], runs))
+    record("glob", _time_ops(lambda i: [f"echo {leaf}*.txt"], repeat))
+    record("grep", _time_ops(lambda i: ["grep -rl 'line 42' /"], runs))
+    # Тот же поиск с заданным числом потоков grep
+    default_jobs = stepn1.CONFIG["grep_jobs"]
+    for jobs in grep_jobs:
+        stepn1.CONFIG["grep_jobs"] = jobs
+        record(f"grep-j{jobs}", _time_ops(lambda i: ["grep -rl 'line 42' /"], runs))
+    stepn1.CONFIG["grep_jobs"] = default_jobs
+    record("du", _time_ops(lambda i: ["du -s /"], repeat))
+    # Накладные расходы разбора и диспетчеризации: дешёвые команды, повторяющиеся как в циклах скриптов
+    record("dispatch", _time_ops(lambda i: ["pwd", "echo $HOME done", f"cd {leaf}", "cd /"] * 25, repeat))
+    if samples["text"]:
+        record("cat", _time_ops(lambda i: [f"cat {samples['text']}"], repeat))
+        record("rev", _time_ops(lambda i: [f"rev {samples['text']}"], repeat))
+    if samples["binary"]:
+        record("cat-binary", _time_ops(lambda i: [f"cat {samples['binary']}"], repeat))
+    # Перенос верхней папки со всем поддеревом туда и обратно
+    record("mv", _time_ops(lambda i: [f"mv {top} /moved", f"mv /moved {top}"], repeat))
+    runs = min(repeat, samples["empty_dirs"])
+    record("rmdir", _time_ops(lambda i: [f"rmdir /empty{i}"], runs))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк команд VFS на синтетических архивах")
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000], help="Числа файлов в архивах")
+    parser.add_argument("--depth", type=int, default=3, help="Глубина дерева папок")
+    parser.add_argument("--fanout", type=int, default=8, help="Число подпапок у каждой папки")
+    parser.add_argument("--file-size", type=int, default=4096, help="Размер файла, байт")
+    parser.add_argument("--binary-ratio", type=float, default=0.2, help="Доля бинарных файлов")
+    parser.add_argument("--mode", nargs="+", choices=["eager", "lazy", "mmap"], default=["eager"],
+                        help="Режимы загрузки архива")
+    parser.add_argument("--grep-jobs", dest="grep_jobs", type=int, nargs="+", default=[],
+                        help="Числа потоков grep для отдельных замеров (grep-jN)")
+    parser.add_argument("-r", "--repeat", type=int, default=100, help="Число повторов каждой команды")
+    parser.add_argument("-o", "--output", default=None, help="Файл для результатов (JSON Lines)")
+    parser.add_argument("--workdir", default=None, help="Папка для архивов (по умолчанию временная)")
+    args = parser.parse_args()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory())
+        for files in args.files:
+            params = {"files": files, "depth": args.depth, "fanout": args.fanout,
+                      "file_size": args.file_size, "binary_ratio": args.binary_ratio}
+            zip_path = os.path.join(workdir, f"synthetic_{files}_{args.depth}_{args.fanout}.zip")
+            samples = generate_archive(zip_path, files, args.depth, args.fanout,
+                                       args.file_size, args.binary_ratio)
+            for mode in args.mode:
+                with contextlib.redirect_stdout(_NullOutput()):
+                    results = bench_archive(zip_path, samples, mode, args.repeat, args.grep_jobs)
+                for result in results:
+                    out.write(json.dumps({**params, "mode": mode, **result}, ensure_ascii=False) + "\n")
+                out.flush()
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
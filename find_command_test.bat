@@ -0,0 +1,11 @@
+@echo off
+chcp 65001 > nul
+echo === ТЕСТИРОВАНИЕ FIND, LS -R И ШАБЛОНОВ ===
+echo.
+
+echo Запуск теста на search_test.zip:
+python stepn1.py -v search_test.zip -s find_command_test.txt --no-interactive
+
+echo.
+echo === ТЕСТИРОВАНИЕ ЗАВЕРШЕНО ===
+pause
\ No newline at end of file
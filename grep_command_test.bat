@@ -0,0 +1,15 @@
+@echo off
+chcp 65001 > nul
+echo === ТЕСТИРОВАНИЕ GREP ===
+echo.
+
+echo Запуск теста grep на search_test.zip:
+python stepn1.py -v search_test.zip -s grep_command_test.txt --no-interactive
+
+echo.
+echo Тот же тест с триграммным индексом (вывод должен совпасть):
+python stepn1.py -v search_test.zip -s grep_command_test.txt --no-interactive --grep-index
+
+echo.
+echo === ТЕСТИРОВАНИЕ ЗАВЕРШЕНО ===
+pause
\ No newline at end of file
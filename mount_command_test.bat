@@ -0,0 +1,15 @@
+@echo off
+chcp 65001 > nul
+echo === ТЕСТИРОВАНИЕ MOUNT ===
+echo.
+
+echo Запуск теста на multilevel.zip:
+python stepn1.py -v multilevel.zip -s mount_command_test.txt --no-interactive
+
+echo.
+echo Несколько архивов в -v монтируются поверх первого:
+python stepn1.py -v multilevel.zip minimal.zip -s mount_command_test.txt --no-interactive
+
+echo.
+echo === ТЕСТИРОВАНИЕ ЗАВЕРШЕНО ===
+pause
\ No newline at end of file
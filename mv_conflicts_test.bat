@@ -0,0 +1,11 @@
+@echo off
+chcp 65001 > nul
+echo === ТЕСТИРОВАНИЕ КОНФЛИКТОВ MV ===
+echo.
+
+echo Запуск теста на multilevel.zip:
+python stepn1.py -v multilevel.zip -s mv_conflicts_test.txt --no-interactive
+
+echo.
+echo === ТЕСТИРОВАНИЕ ЗАВЕРШЕНО ===
+pause
\ No newline at end of file
@@ -0,0 +1,12 @@
+@echo off
+chcp 65001 > nul
+echo === ТЕСТИРОВАНИЕ VFS-SAVE ===
+echo.
+
+echo Запуск теста на search_test.zip:
+python stepn1.py -v search_test.zip -s save_command_test.txt --no-interactive
+del saved_test.zip 2> nul
+
+echo.
+echo === ТЕСТИРОВАНИЕ ЗАВЕРШЕНО ===
+pause
\ No newline at end of file
@@ -3,14 +3,47 @@ import sys
 import shlex
 import re
 import argparse
-import zipfile
-import base64
-
-try:
-    sys.stdin.reconfigure(encoding="utf-8", errors="replace")
-    sys.stdout.reconfigure(encoding="utf-8", errors="replace")
-except Exception:
-    pass
+import importlib.util
+import fnmatch
+import codecs
+import mmap
+import struct
+import zlib
+import marshal
+import contextlib
+import contextvars
+import threading
+import queue
+import time
+from array import array
+from collections import OrderedDict
+
+
+def _lazy_import(name: str):
+    """Модуль, который загружается при первом обращении к его атрибутам (ускоряет запуск)"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# zipfile нужен только при работе с архивами, asyncio - только в режиме сервера;
+# tempfile, hashlib и concurrent.futures импортируются в функциях, которые ими пользуются
+zipfile = _lazy_import("zipfile")
+asyncio = _lazy_import("asyncio")
+
+# Перекодировка stdio нужна, только если кодировка потока ещё не UTF-8
+for _stream in (sys.stdin, sys.stdout):
+    try:
+        if (_stream.encoding or "").lower().replace("-", "") != "utf8":
+            _stream.reconfigure(encoding="utf-8", errors="replace")
+    except Exception:
+        pass
 
 if os.name == "nt":
     try:
@@ -27,52 +60,975 @@ if os.name == "nt":
 VFS_NAME = "MYVFS"
 CONFIG = {
     "vfs_root": None,
+    # архивы, смонтированные поверх vfs_root (остальные пути -v)
+    "vfs_overlays": [],
     "startup_script": None,
     "no_interactive": False,
+    "lazy": False,
+    "cache_mb": 64,
+    "mmap": False,
+    "load_jobs": 1,
+    "index_dir": None,
+    "serve": None,
+    "profile": False,
+    "grep_jobs": min(8, os.cpu_count() or 1),
+    "grep_index": False,
+    "save_on_exit": None,
+    "batch": False,
+    "quiet": False,
 }
 
 # VFS (Виртуальная Файловая Система)
 VFS = {
-    "files": {},
-    "folders": set(),
-    "cwd": "/",
-    "loaded": False
+    "root": None,
+    "loaded": False,
+    # смонтированные архивы (слои) снизу вверх, см. _new_layer
+    "layers": [],
+    # одинаковые файлы, хранящиеся в одном экземпляре после загрузки, и сэкономленные байты
+    "dedup_files": 0,
+    "dedup_bytes": 0,
+    # поколение дерева: узлы прошлых поколений общие со снимками и на месте не меняются
+    "epoch": 0,
+}
+
+# снимки VFS: имя -> корень дерева (неизменяемый, поддеревья общие с текущим деревом)
+SNAPSHOTS = {}
+
+
+class DirNode:
+    """Узел директории VFS: хранит собственные дочерние элементы по имени"""
+    __slots__ = ("children", "epoch", "files", "dirs", "size")
+
+    def __init__(self, children=None):
+        # имя -> DirNode (папка) или FileEntry (файл)
+        self.children = {} if children is None else children
+        # поколение, в котором создан узел: менять на месте можно только узлы текущего
+        self.epoch = VFS["epoch"]
+        # итоги поддерева (файлы, подпапки, байты): считаются при загрузке, дальше меняются приращениями
+        self.files = self.dirs = self.size = 0
+
+
+class FileEntry:
+    """Файл VFS: сырые байты и признак текстового содержимого"""
+    __slots__ = ("data", "info", "is_text", "layer")
+
+    def __init__(self, data=None, info=None, is_text=None, layer=None):
+        # bytes/memoryview; None - ещё не распакован из архива (ленивый режим)
+        self.data = data
+        # ZipInfo (или MemberInfo из индекса) исходного элемента архива
+        self.info = info
+        # None - тип ещё не определён
+        self.is_text = is_text
+        # слой (архив), из которого взят файл
+        self.layer = layer
+
+
+VFS["root"] = DirNode()
+
+
+def _new_layer(zip_path: str, mount: str = "/") -> dict:
+    """Слой VFS: архив, смонтированный в папку; дескрипторы открываются по требованию"""
+    return {
+        "path": zip_path,
+        "mount": mount,
+        # открытый архив для ленивой подгрузки содержимого
+        "zipfile": None,
+        # дескриптор архива для прямого чтения элементов
+        "file": None,
+        # отображение архива в память (режим --mmap)
+        "mmap": None,
+    }
+
+# Сеанс оболочки: своя текущая директория и свой поток вывода (None - stdout процесса).
+# Все сеансы работают с одной VFS.
+MAIN_SESSION = {"cwd": "/", "out": None}
+SESSION = contextvars.ContextVar("session", default=MAIN_SESSION)
+# открытые сеансы: их текущие директории поправляются при mv/rmdir/vfs-init
+SESSIONS = {id(MAIN_SESSION): MAIN_SESSION}
+# сколько ждать, пока клиент сервера примет вывод, прежде чем разорвать сеанс, секунд
+SESSION_DRAIN_TIMEOUT = 30
+
+
+def _session() -> dict:
+    return SESSION.get()
+
+
+def _reset_all_cwd() -> None:
+    for session in list(SESSIONS.values()):
+        session["cwd"] = "/"
+
+
+class RWLock:
+    """Блокировка читатели-писатель: чтения VFS идут параллельно, изменения - монопольно"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._cond:
+            # Ожидающий писатель пропускается вперёд, чтобы его не задавили чтения
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+VFS_LOCK = RWLock()
+# общий дескриптор архива и ленивое открытие ZipFile защищены отдельно: их используют чтения
+_ARCHIVE_LOCK = threading.Lock()
+
+
+class ContentCache:
+    """LRU-кэш распакованного содержимого с ограничением по байтам"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._items = OrderedDict()
+        # кэш меняется и при чтении, а чтения из разных сеансов идут параллельно
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def __contains__(self, key) -> bool:
+        # Проверка без обновления порядка LRU
+        with self._lock:
+            return key in self._items
+
+    def put(self, key, value, size: int) -> None:
+        # Файлы больше всего бюджета не кэшируем
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self._items[key] = (value, size)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.used_bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.used_bytes = 0
+
+
+CONTENT_CACHE = ContentCache(CONFIG["cache_mb"] * 1024 * 1024)
+
+
+class ContentStore:
+    """Хранилище содержимого с адресацией по CRC-32 и размеру из каталога ZIP.
+
+    Кандидаты в дубликаты находятся по метаданным без чтения данных; совпадение
+    подтверждается SHA-256, который считается только при появлении кандидата.
+    """
+
+    def __init__(self):
+        # (CRC, размер) -> [[sha256 или None, данные], ...]
+        self._payloads = {}
+        self.duplicates = 0
+        self.saved_bytes = 0
+
+    @staticmethod
+    def _digest(slot: list) -> bytes:
+        if slot[0] is None:
+            import hashlib
+
+            slot[0] = hashlib.sha256(slot[1]).digest()
+        return slot[0]
+
+    def intern(self, crc: int, data):
+        """Возвращает уже сохранённые данные с тем же содержимым или сохраняет новые"""
+        if not data:
+            return data
+        slots = self._payloads.setdefault((crc, len(data)), [])
+        if slots:
+            digest = self._digest([None, data])
+            for slot in slots:
+                if self._digest(slot) == digest:
+                    self.duplicates += 1
+                    self.saved_bytes += len(data)
+                    return slot[1]
+            slots.append([digest, data])
+        else:
+            slots.append([None, data])
+        return data
+
+# Профиль команд (--profile): длительности вызовов и число затронутых элементов VFS
+PROFILE = {
+    "enabled": False,
+    "load_seconds": None,
+    # команда -> {"times": array секунд, "touched": сумма элементов}
+    "commands": {},
 }
+# строка профиля для всех неизвестных команд: ввод клиентов --serve не должен плодить строки
+PROFILE_UNKNOWN = "(unknown)"
+_PROFILE_LOCK = threading.Lock()
+# счётчик затронутых элементов текущей команды (у каждого рабочего потока свой)
+_PROFILE_TLS = threading.local()
+
+
+def _touch(count: int) -> None:
+    if PROFILE["enabled"]:
+        _PROFILE_TLS.touched = getattr(_PROFILE_TLS, "touched", 0) + count
+
+
+def _record_command(cmd: str, seconds: float, touched: int) -> None:
+    with _PROFILE_LOCK:
+        record = PROFILE["commands"].get(cmd)
+        if record is None:
+            record = PROFILE["commands"][cmd] = {"times": array('d'), "touched": 0}
+        record["times"].append(seconds)
+        record["touched"] += touched
 
 
 def make_prompt() -> str:
-    return f"[{VFS_NAME} {VFS['cwd']}]$ "
+    return f"[{VFS_NAME} {_session()['cwd']}]$ "
+
+
+def _split_vfs_path(path: str) -> list[str]:
+    """Разбивает путь VFS на компоненты, отбрасывая пустые"""
+    return [part for part in path.split('/') if part]
+
+
+def _lookup_node(parts: list[str]):
+    """Возвращает узел по компонентам пути или None"""
+    _touch(len(parts))
+    node = VFS["root"]
+    for name in parts:
+        if not isinstance(node, DirNode):
+            return None
+        node = node.children.get(name)
+        if node is None:
+            return None
+    return node
+
+
+# кэш разрешения путей: (cwd, аргумент) -> (компоненты, узел); сбрасывается при изменении VFS
+_RESOLVE_CACHE = {}
+RESOLVE_CACHE_LIMIT = 4096
+
+
+def _normalize_path(path: str, cwd: str = "/") -> tuple[str, ...]:
+    """Нормализует путь относительно cwd в кортеж интернированных компонентов с учётом '.' и '..'"""
+    parts = [] if path.startswith('/') else _split_vfs_path(cwd)
+    for name in path.split('/'):
+        if not name or name == '.':
+            continue
+        if name == '..':
+            # Выше корня подняться нельзя
+            if parts:
+                parts.pop()
+            continue
+        parts.append(sys.intern(name))
+    return tuple(parts)
+
+
+def _resolve(path: str) -> tuple:
+    """Разрешает путь относительно текущей директории сеанса: (компоненты, узел или None)"""
+    key = (_session()["cwd"], path)
+    result = _RESOLVE_CACHE.get(key)
+    if result is None:
+        parts = _normalize_path(path, key[0])
+        result = (parts, _lookup_node(parts))
+        if len(_RESOLVE_CACHE) >= RESOLVE_CACHE_LIMIT:
+            _RESOLVE_CACHE.clear()
+        _RESOLVE_CACHE[key] = result
+    return result
+
+
+def _invalidate_paths() -> None:
+    """Сбрасывает кэш путей: вызывается при любом изменении дерева VFS"""
+    _RESOLVE_CACHE.clear()
+
+
+def _dir_path(parts) -> str:
+    return '/' + '/'.join(parts) + '/' if parts else '/'
+
+
+def _own(node: DirNode) -> DirNode:
+    """Узел, который можно менять на месте: общий со снимком узел заменяется копией"""
+    if node.epoch == VFS["epoch"]:
+        return node
+    copy = DirNode(dict(node.children))
+    copy.files, copy.dirs, copy.size = node.files, node.dirs, node.size
+    return copy
+
+
+def _totals(node) -> tuple[int, int, int]:
+    """Вклад узла в итоги родителя: (файлы, папки, байты)"""
+    if isinstance(node, DirNode):
+        return node.files, node.dirs + 1, node.size
+    return 1, 0, _file_size(node)
+
+
+def _sum_children(node: DirNode) -> None:
+    """Пересчитывает итоги папки по итогам её детей"""
+    files = dirs = size = 0
+    for child in node.children.values():
+        child_files, child_dirs, child_size = _totals(child)
+        files += child_files
+        dirs += child_dirs
+        size += child_size
+    node.files, node.dirs, node.size = files, dirs, size
+
+
+def _compute_totals(root: DirNode) -> None:
+    """Считает итоги всех папок нового дерева (обход в обратном порядке: дети раньше родителей)"""
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(child for child in node.children.values() if isinstance(child, DirNode))
+    for node in reversed(order):
+        _sum_children(node)
+
+
+def _update_totals(parts, files: int, dirs: int, size: int) -> None:
+    """Прибавляет приращение к итогам корня и всех папок на пути (папки уже изменяемые, см. _ensure_dir)"""
+    node = VFS["root"]
+    while True:
+        node.files += files
+        node.dirs += dirs
+        node.size += size
+        if not parts:
+            return
+        node = node.children[parts[0]]
+        parts = parts[1:]
+
+
+def _ensure_dir(parts: list[str]) -> DirNode:
+    """Возвращает изменяемую директорию по компонентам пути, создавая недостающие узлы.
+
+    Узлы на пути, общие со снимками, копируются (path copying): снимки остаются нетронутыми.
+    """
+    node = VFS["root"] = _own(VFS["root"])
+    for name in parts:
+        child = node.children.get(name)
+        if not isinstance(child, DirNode):
+            child = DirNode()
+        else:
+            child = _own(child)
+        node.children[name] = child
+        node = child
+    return node
+
+
+def _is_file(node) -> bool:
+    return isinstance(node, FileEntry)
+
+
+# сколько байт из начала файла проверяется при определении типа
+SNIFF_BYTES = 8192
+
+
+def _sniff_text(data, size: int | None = None) -> bool:
+    """Определяет текстовый файл по префиксу: без NUL-байтов и корректный UTF-8"""
+    prefix = bytes(data[:SNIFF_BYTES])
+    if size is None:
+        size = len(data)
+    if b"\0" in prefix:
+        return False
+    try:
+        # Незавершённый многобайтовый символ на границе префикса не считается ошибкой
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=size <= SNIFF_BYTES)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def _cache_key(entry: FileEntry) -> tuple:
+    # Одно и то же имя может встречаться в разных слоях
+    return entry.layer["path"], entry.info.filename
+
+
+def _mmap_stored(entry: FileEntry) -> bool:
+    return entry.info.compress_type == zipfile.ZIP_STORED and _mmap_readable(entry.layer, entry.info)
+
+
+def _file_data(entry: FileEntry):
+    """Возвращает байты файла, при необходимости распаковывая их из архива"""
+    if entry.data is not None:
+        return entry.data
+
+    if _mmap_stored(entry):
+        # Несжатый элемент отображения: при первом обращении находится начало данных и
+        # проверяется CRC, дальше срез хранится в записи (без копирования и без кэша)
+        entry.data = _read_member(entry.layer, entry.info)
+        return entry.data
+
+    # Ленивый режим: содержимое читается по требованию
+    key = _cache_key(entry)
+    data = CONTENT_CACHE.get(key)
+    if data is None:
+        data = _read_member(entry.layer, entry.info)
+        CONTENT_CACHE.put(key, data, len(data))
+    return data
+
+
+def _needs_inflate(entry: FileEntry) -> bool:
+    """Содержимого нет в памяти: чтение пойдёт через zlib, который отпускает GIL"""
+    return entry.data is None and not _mmap_stored(entry) and _cache_key(entry) not in CONTENT_CACHE
+
+
+def _file_is_text(entry: FileEntry) -> bool:
+    if entry.is_text is None:
+        data = _resident_data(entry)
+        if data is not None:
+            entry.is_text = _sniff_text(data)
+        else:
+            # Большой файл: распаковывается только префикс
+            prefix = b""
+            chunks = _iter_member_chunks(entry.layer, entry.info)
+            for chunk in chunks:
+                prefix += bytes(chunk)
+                if len(prefix) > SNIFF_BYTES:
+                    break
+            chunks.close()
+            entry.is_text = _sniff_text(prefix, entry.info.file_size)
+    return entry.is_text
+
+
+def _file_size(entry: FileEntry) -> int:
+    return len(entry.data) if entry.data is not None else entry.info.file_size
+
+
+def _resident_data(entry: FileEntry):
+    """Байты файла, если они в памяти или файл помещается в кэш; иначе None"""
+    if entry.data is not None:
+        return entry.data
+    data = CONTENT_CACHE.get(_cache_key(entry))
+    if data is None and entry.info.file_size <= CONTENT_CACHE.max_bytes:
+        data = _file_data(entry)
+    return data
+
+
+# сигнатура и размер локального заголовка элемента ZIP
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_LOCAL_HEADER_SIZE = 30
+
+
+class MemberInfo:
+    """Метаданные элемента архива, восстановленные из индекса (вместо ZipInfo)"""
+    __slots__ = ("filename", "header_offset", "compress_size", "file_size",
+                 "compress_type", "flag_bits", "CRC")
+
+    def __init__(self, filename, header_offset=0, compress_size=0, file_size=0,
+                 compress_type=0, flag_bits=0, crc=0):
+        # compress_type=0 - ZIP_STORED: константа не берётся из zipfile, чтобы не загружать его при импорте
+        self.filename = filename
+        self.header_offset = header_offset
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.compress_type = compress_type
+        self.flag_bits = flag_bits
+        self.CRC = crc
+
+    def is_dir(self) -> bool:
+        return self.filename.endswith('/')
+
+
+def _data_offset(header: bytes, info) -> int:
+    """Смещение данных элемента от начала его локального заголовка"""
+    if header[:4] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack_from("<HH", header, 26)
+    return _LOCAL_HEADER_SIZE + name_len + extra_len
+
+
+def _member_view(mapped: mmap.mmap, info) -> memoryview:
+    """Срез отображения с данными элемента архива (без копирования)"""
+    offset = info.header_offset
+    start = offset + _data_offset(mapped[offset:offset + _LOCAL_HEADER_SIZE], info)
+    return memoryview(mapped)[start:start + info.compress_size]
+
+
+def _raw_readable(info) -> bool:
+    # Зашифрованные элементы и экзотические методы сжатия читает zipfile
+    return (not info.flag_bits & 0x1
+            and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED))
+
+
+def _mmap_readable(layer: dict, info) -> bool:
+    return layer["mmap"] is not None and _raw_readable(info)
+
+
+def _archive_zipfile(layer: dict) -> "zipfile.ZipFile":
+    """ZipFile архива слоя; после загрузки из индекса открывается только по требованию"""
+    with _ARCHIVE_LOCK:
+        if layer["zipfile"] is None:
+            layer["zipfile"] = zipfile.ZipFile(layer["path"], 'r')
+        return layer["zipfile"]
+
+
+def _read_archive_at(layer: dict, offset: int, size: int) -> bytes:
+    """Читает байты из файла архива по смещению; общий дескриптор открывается по требованию"""
+    with _ARCHIVE_LOCK:
+        if layer["file"] is None:
+            layer["file"] = open(layer["path"], 'rb')
+        raw = layer["file"]
+        raw.seek(offset)
+        return raw.read(size)
+
+
+def _open_member(zip_ref: "zipfile.ZipFile", info):
+    # Метаданные из индекса не являются ZipInfo - элемент ищется по имени
+    return zip_ref.open(info if isinstance(info, zipfile.ZipInfo) else info.filename)
+
+
+def _read_member(layer: dict, info):
+    """Читает содержимое элемента архива: из отображения или напрямую из файла"""
+    if _mmap_readable(layer, info):
+        # Несжатый элемент - срез отображения, сжатый распаковывается прямо из него
+        data = _member_view(layer["mmap"], info)
+    elif _raw_readable(info):
+        # Прямое чтение по смещению: центральный каталог для этого не нужен
+        start = info.header_offset + _data_offset(_read_archive_at(layer, info.header_offset, _LOCAL_HEADER_SIZE), info)
+        data = _read_archive_at(layer, start, info.compress_size)
+    else:
+        with _open_member(_archive_zipfile(layer), info) as file:
+            return file.read()
+
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    if zlib.crc32(data) != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    return data
+
+
+# размер блока при потоковом чтении файлов
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_slices(data):
+    view = memoryview(data)
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield view[start:start + CHUNK_SIZE]
+
+
+def _iter_inflated(pieces):
+    """Распаковывает deflate-поток блоками не больше CHUNK_SIZE"""
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    for piece in pieces:
+        while piece:
+            chunk = inflater.decompress(piece, CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            piece = inflater.unconsumed_tail
+    tail = inflater.flush()
+    if tail:
+        yield tail
+
+
+def _iter_raw_pieces(layer: dict, info):
+    """Читает сжатые данные элемента из файла архива блоками"""
+    position = info.header_offset + _data_offset(_read_archive_at(layer, info.header_offset, _LOCAL_HEADER_SIZE), info)
+    remaining = info.compress_size
+    while remaining > 0:
+        # Дескриптор общий: позиция выставляется перед каждым чтением
+        piece = _read_archive_at(layer, position, min(CHUNK_SIZE, remaining))
+        if not piece:
+            raise zipfile.BadZipFile(f"Truncated data for file {info.filename!r}")
+        position += len(piece)
+        remaining -= len(piece)
+        yield piece
+
+
+def _iter_member_chunks(layer: dict, info):
+    """Отдаёт распакованное содержимое элемента архива блоками"""
+    if _mmap_readable(layer, info):
+        pieces = _iter_slices(_member_view(layer["mmap"], info))
+    elif _raw_readable(info):
+        pieces = _iter_raw_pieces(layer, info)
+    else:
+        with _open_member(_archive_zipfile(layer), info) as file:
+            while chunk := file.read(CHUNK_SIZE):
+                yield chunk
+        return
+
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        pieces = _iter_inflated(pieces)
+    crc = 0
+    for chunk in pieces:
+        crc = zlib.crc32(chunk, crc)
+        yield chunk
+    if crc != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+
+
+def _iter_file_chunks(entry: FileEntry):
+    """Отдаёт содержимое файла блоками, не собирая большие файлы в памяти целиком"""
+    data = _resident_data(entry)
+    if data is not None:
+        return _iter_slices(data)
+    return _iter_member_chunks(entry.layer, entry.info)
+
+
+@contextlib.contextmanager
+def _random_access(entry: FileEntry):
+    """Даёт (read_at(start, end), размер) для чтения файла с произвольной позиции"""
+    data = _resident_data(entry)
+    if data is None and _mmap_stored(entry):
+        # Большой несжатый файл из отображения читается с любой позиции без временного файла
+        data = _file_data(entry)
+    if data is not None:
+        yield (lambda start, end: data[start:end]), len(data)
+        return
+
+    import tempfile
+
+    # Сжатый большой файл нельзя читать с конца: распаковываем во временный файл
+    with tempfile.TemporaryFile() as spill:
+        for chunk in _iter_member_chunks(entry.layer, entry.info):
+            spill.write(chunk)
+        size = spill.tell()
+
+        def read_at(start: int, end: int) -> bytes:
+            spill.seek(start)
+            return spill.read(end - start)
+
+        yield read_at, size
+
+
+def _iter_reversed_text(entry: FileEntry):
+    """Отдаёт текст файла в обратном порядке, читая блоки с конца"""
+    with _random_access(entry) as (read_at, size):
+        end = size
+        while end > 0:
+            start = max(0, end - CHUNK_SIZE)
+            chunk = bytes(read_at(start, end))
+            if start > 0:
+                # Продолжения UTF-8 в начале блока относятся к символу из предыдущего блока
+                skip = 0
+                while skip < 3 and skip < len(chunk) and chunk[skip] & 0xC0 == 0x80:
+                    skip += 1
+                chunk = chunk[skip:]
+                start += skip
+            yield chunk.decode('utf-8', errors='replace')[::-1]
+            end = start
+
+
+def _close_layer(layer: dict) -> None:
+    """Закрывает дескрипторы архива слоя (при следующем чтении они откроются заново)"""
+    if layer["zipfile"] is not None:
+        layer["zipfile"].close()
+        layer["zipfile"] = None
+    if layer["file"] is not None:
+        layer["file"].close()
+        layer["file"] = None
+    if layer["mmap"] is not None:
+        try:
+            layer["mmap"].close()
+        except BufferError:
+            # Срезы ещё используются: отображение закроется вместе с ними
+            pass
+        layer["mmap"] = None
+
+
+def _close_archives() -> None:
+    """Отключает все слои VFS"""
+    for layer in VFS["layers"]:
+        _close_layer(layer)
+    VFS["layers"] = []
+    CONTENT_CACHE.clear()
+
+
+def _count_nodes(node: DirNode) -> tuple[int, int]:
+    """(файлы, папки) в поддереве - из итогов узла, без обхода"""
+    return node.files, node.dirs
+
 
+# версия формата индекса: при изменении старые индексы игнорируются
+INDEX_VERSION = 2
+# сколько байт с конца архива хэшируется для ключа индекса (там центральный каталог)
+INDEX_TAIL_BYTES = 64 * 1024
 
-def load_vfs_from_zip(zip_path: str) -> bool:
+
+def _default_index_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "vfs-emulator")
+
+
+def _index_key(zip_path: str) -> tuple:
+    """Ключ индекса: путь, размер, mtime и хэш хвоста архива"""
+    import hashlib
+
+    stat = os.stat(zip_path)
+    with open(zip_path, 'rb') as file:
+        file.seek(max(0, stat.st_size - INDEX_TAIL_BYTES))
+        digest = hashlib.sha1(file.read()).hexdigest()
+    return os.path.abspath(zip_path), stat.st_size, stat.st_mtime_ns, digest
+
+
+def _index_path(index_dir: str, zip_path: str) -> str:
+    import hashlib
+
+    name = hashlib.sha1(os.path.abspath(zip_path).encode('utf-8')).hexdigest()
+    return os.path.join(index_dir, name + ".idx")
+
+
+def _load_index(index_dir: str, zip_path: str, key: tuple) -> tuple | None:
+    """Файлы и дерево архива из индекса: ([(MemberInfo, is_text)], корень, места файлов).
+
+    В индексе только файлы (в порядке архива), папки восстанавливаются с итогами. Места файлов -
+    (папка, имя, номер файла): FileEntry вставляются в них после чтения элементов.
+    None - индекса нет, он устарел или повреждён (тогда дерево строится заново).
+    """
+    try:
+        with open(_index_path(index_dir, zip_path), 'rb') as file:
+            payload = marshal.loads(file.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != INDEX_VERSION or payload.get("key") != key:
+        return None
+    try:
+        members = [(MemberInfo(*record[:-1]), record[-1]) for record in payload["entries"]]
+        root = DirNode()
+        root.files, root.dirs, root.size = payload["totals"]
+        nodes = [root]
+        slots = []
+        for record in payload["tree"]:
+            parent, name, member = nodes[record[0]], record[1], record[2]
+            if member < 0:
+                node = DirNode()
+                node.files, node.dirs, node.size = record[3:]
+                nodes.append(node)
+                parent.children[name] = node
+            elif member >= len(members):
+                return None
+            else:
+                # Место занимается сразу: порядок детей папки как при построении
+                parent.children[name] = None
+                slots.append((parent, name, member))
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    return members, root, slots
+
+
+def _save_index(index_dir: str, zip_path: str, key: tuple, members: list, root: DirNode, entries: list) -> None:
+    """Атомарно записывает индекс: файлы архива со смещениями и типом, папки с итогами и места файлов"""
+    files = [(info, entry) for (info, _), entry in zip(members, entries) if entry is not None]
+    records = [(info.filename, info.header_offset, info.compress_size, info.file_size,
+                info.compress_type, info.flag_bits, info.CRC, entry.is_text)
+               for info, entry in files]
+    member_of = {id(entry): i for i, (_, entry) in enumerate(files)}
+    # Папки в порядке обхода в ширину: родитель всегда раньше детей и получает номер раньше них
+    tree = []
+    directories = [root]
+    for index, node in enumerate(directories):
+        for name, child in node.children.items():
+            if isinstance(child, DirNode):
+                tree.append((index, name, -1, child.files, child.dirs, child.size))
+                directories.append(child)
+            else:
+                tree.append((index, name, member_of[id(child)]))
+    payload = {"version": INDEX_VERSION, "key": key, "entries": records,
+               "totals": (root.files, root.dirs, root.size), "tree": tree}
+    path = _index_path(index_dir, zip_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        with open(tmp_path, 'wb') as file:
+            file.write(marshal.dumps(payload))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Предупреждение: не удалось сохранить индекс VFS: {e}")
+
+
+def _split_by_size(infos: list, parts: int) -> list[list]:
+    """Делит элементы на смежные группы примерно равного распакованного размера"""
+    total = sum(info.file_size for info in infos) or 1
+    target = total / parts
+    groups, current, acc = [], [], 0
+    for info in infos:
+        current.append(info)
+        acc += info.file_size
+        if acc >= target * (len(groups) + 1) and len(groups) < parts - 1:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _read_members_parallel(zip_path: str, infos: list, jobs: int) -> list:
+    """Распаковывает элементы в пуле потоков и возвращает [(данные, is_text)] в исходном порядке"""
+
+    def worker(group: list) -> list:
+        # У каждой задачи свой дескриптор архива: ZipFile не потокобезопасен
+        result = []
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for info in group:
+                with _open_member(zip_ref, info) as file:
+                    data = file.read()
+                result.append((data, _sniff_text(data)))
+        return result
+
+    # По одной группе на поток: открытие ZipFile заново разбирает центральный каталог
+    from concurrent.futures import ThreadPoolExecutor
+
+    groups = _split_by_size(infos, jobs)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return [item for group in pool.map(worker, groups) for item in group]
+
+
+def _tree_dir(root: DirNode, parts: list[str]) -> DirNode:
+    """Директория строящегося дерева по компонентам пути; недостающие узлы создаются"""
+    node = root
+    for name in parts:
+        child = node.children.get(name)
+        if not isinstance(child, DirNode):
+            child = DirNode()
+            node.children[name] = child
+        node = child
+    return node
+
+
+def _member_entries(layer: dict, members: list, lazy: bool, use_mmap: bool, jobs: int) -> list:
+    """FileEntry для элементов архива слоя (None для папок) в порядке элементов"""
+    preloaded = None
+    if jobs > 1 and not (lazy or use_mmap):
+        # Полная загрузка: распаковка и определение типа идут в пуле потоков
+        files = [info for info, _ in members if not info.filename.endswith('/')]
+        preloaded = iter(_read_members_parallel(layer["path"], files, jobs))
+
+    # Одинаковые файлы, распакованные в память, хранятся в одном экземпляре
+    store = ContentStore()
+    entries = []
+    for info, is_text in members:
+        entry = None
+        # Папки и элементы без имени файла ('dir/') остаются None
+        if not info.filename.endswith('/'):
+            if lazy or use_mmap:
+                # Только метаданные: распаковка (или срез отображения) при первом cat/rev
+                entry = FileEntry(info=info, is_text=is_text, layer=layer)
+            elif preloaded is not None:
+                data, is_text = next(preloaded)
+                entry = FileEntry(store.intern(info.CRC, data), info, is_text, layer)
+            else:
+                data = store.intern(info.CRC, _read_member(layer, info))
+                entry = FileEntry(data, info, _sniff_text(data) if is_text is None else is_text, layer)
+        entries.append(entry)
+    VFS["dedup_files"] += store.duplicates
+    VFS["dedup_bytes"] += store.saved_bytes
+    return entries
+
+
+def _build_tree(members: list, entries: list, root: DirNode) -> None:
+    """Раскладывает файлы архива по папкам дерева root; папки из путей файлов создаются"""
+    # Соседние элементы архива обычно лежат в одной папке: узлы папок запоминаются по пути
+    parents = {"": root}
+    for (info, _), entry in zip(members, entries):
+        dirname, _, name = info.filename.rpartition('/')
+        if info.is_dir():
+            _tree_dir(root, _split_vfs_path(info.filename))
+        elif name:
+            parent = parents.get(dirname)
+            if parent is None:
+                # Папки из путей файлов становятся полноценными узлами
+                parent = parents[dirname] = _tree_dir(root, _split_vfs_path(dirname))
+            parent.children[name] = entry
+
+
+def _load_layer(layer: dict, lazy: bool, use_mmap: bool, jobs: int, index_dir: str | None) -> tuple:
+    """Строит дерево архива слоя: (корень, структура восстановлена из индекса)"""
+    zip_path = layer["path"]
+    key = _index_key(zip_path) if index_dir else None
+    indexed = _load_index(index_dir, zip_path, key) if index_dir else None
+    try:
+        if indexed is not None:
+            # Индекс актуален: центральный каталог не разбирается, папки и их итоги уже построены
+            members, root, slots = indexed
+        else:
+            members = [(info, None) for info in _archive_zipfile(layer).infolist()]
+        if use_mmap:
+            with open(zip_path, 'rb') as raw:
+                layer["mmap"] = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        entries = _member_entries(layer, members, lazy, use_mmap, jobs)
+        if indexed is not None:
+            for parent, name, member in slots:
+                parent.children[name] = entries[member]
+        else:
+            root = DirNode()
+            _build_tree(members, entries, root)
+            _compute_totals(root)
+    except BaseException:
+        _close_layer(layer)
+        raise
+
+    if not (lazy or use_mmap):
+        # Всё содержимое уже в памяти - дескрипторы архива больше не нужны
+        _close_layer(layer)
+
+    if index_dir and indexed is None:
+        _save_index(index_dir, zip_path, key, members, root, entries)
+    return root, indexed is not None
+
+
+def load_vfs_from_zip(zip_path: str, lazy: bool = False, use_mmap: bool = False, jobs: int = 1,
+                      index_dir: str | None = None) -> bool:
     try:
         if not os.path.exists(zip_path):
             print(f"Ошибка: VFS файл не найден: {zip_path}")
             return False
 
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            VFS["files"] = {}
-            VFS["folders"] = set()
-
-            for file_info in zip_ref.infolist():
-                if file_info.is_dir():
-                    folder_path = file_info.filename
-                    if folder_path and not folder_path.endswith('/'):
-                        folder_path += '/'
-                    VFS["folders"].add(folder_path)
-                else:
-                    with zip_ref.open(file_info.filename) as file:
-                        content = file.read()
-                        try:
-                            VFS["files"][file_info.filename] = content.decode('utf-8')
-                        except UnicodeDecodeError:
-                            VFS["files"][file_info.filename] = f"[base64]{base64.b64encode(content).decode('ascii')}"
-
-            VFS["cwd"] = "/"
-            VFS["loaded"] = True
-            print(f"VFS загружена из: {zip_path}")
-            print(f"Файлов: {len(VFS['files'])}, Папок: {len(VFS['folders'])}")
-            return True
+        started = time.perf_counter()
+        VFS["root"] = DirNode()
+        _close_archives()
+        VFS["dedup_files"] = VFS["dedup_bytes"] = 0
+        layer = _new_layer(zip_path)
+        VFS["root"], indexed = _load_layer(layer, lazy, use_mmap, jobs, index_dir)
+        VFS["layers"] = [layer]
+
+        _reset_all_cwd()
+        _invalidate_paths()
+        _reset_grep_index()
+        # Снимки ссылаются на элементы прежнего архива
+        SNAPSHOTS.clear()
+        VFS["loaded"] = True
+        PROFILE["load_seconds"] = time.perf_counter() - started
+        files, folders = _count_nodes(VFS["root"])
+        print(f"VFS загружена из: {zip_path}")
+        print(f"Файлов: {files}, Папок: {folders}")
+        if indexed:
+            print("Структура VFS восстановлена из индекса")
+        if VFS["dedup_files"]:
+            print(f"Одинаковых файлов: {VFS['dedup_files']}, сэкономлено {VFS['dedup_bytes']} байт")
+        return True
 
     except zipfile.BadZipFile:
         print(f"Ошибка: неправильный формат ZIP-архива: {zip_path}")
@@ -82,83 +1038,285 @@ def load_vfs_from_zip(zip_path: str) -> bool:
         return False
 
 
+def mount_archive(zip_path: str, mount_point: str = "/", use_mmap: bool = False,
+                  index_dir: str | None = None) -> bool:
+    """Монтирует архив поверх VFS (overlay): его файлы перекрывают нижние слои, папки объединяются.
+
+    Слой читается лениво, а его узлы после монтирования неизменяемы: mv/rmdir меняют
+    только копии (верхний слой в памяти), сами слои остаются нетронутыми.
+    """
+    zip_path = os.path.abspath(os.path.expanduser(zip_path))
+    if not os.path.exists(zip_path):
+        print(f"mount: архив не найден: {zip_path}")
+        return False
+    parts = _normalize_path(mount_point, _session()["cwd"])
+    node = VFS["root"]
+    existing = 0
+    for name in parts:
+        node = node.children.get(name)
+        if node is None:
+            break
+        if not isinstance(node, DirNode):
+            print(f"mount: {mount_point}: Not a directory")
+            return False
+        existing += 1
+
+    layer = _new_layer(zip_path, _dir_path(parts))
+    try:
+        layer_root, _ = _load_layer(layer, lazy=True, use_mmap=use_mmap, jobs=1, index_dir=index_dir)
+    except zipfile.BadZipFile:
+        print(f"mount: неправильный формат ZIP-архива: {zip_path}")
+        return False
+    except Exception as e:
+        print(f"mount: ошибка загрузки: {e}")
+        return False
+
+    target = _ensure_dir(parts)
+    for depth in range(existing, len(parts)):
+        _update_totals(parts[:depth], 0, 1, 0)
+    before = _totals(target)
+    _overlay(target, layer_root)
+    if parts:
+        _update_totals(parts[:-1], *(after - old for after, old in zip(_totals(target), before)))
+    VFS["layers"].append(layer)
+    # Новое поколение: узлы слоя становятся общими и дальше только копируются
+    VFS["epoch"] += 1
+    _invalidate_paths()
+    VFS["loaded"] = True
+    files, folders = _count_nodes(layer_root)
+    print(f"Архив {zip_path} смонтирован в {layer['mount']}")
+    print(f"Файлов: {files}, Папок: {folders}")
+    return True
+
+
+def _overlay(lower: DirNode, upper: DirNode) -> None:
+    """Накладывает дерево слоя на изменяемую папку: файлы сверху перекрывают нижние, папки объединяются"""
+    _touch(len(upper.children))
+    for name, child in upper.children.items():
+        below = lower.children.get(name)
+        if isinstance(child, DirNode) and isinstance(below, DirNode):
+            merged = lower.children[name] = _own(below)
+            _overlay(merged, child)
+        else:
+            # Поддерево без пересечений подключается целиком, без копирования
+            lower.children[name] = child
+    # Итоги пересчитываются только у объединённых папок
+    _sum_children(lower)
+
+
 def vfs_init():
-    VFS["files"] = {}
-    VFS["folders"] = set()
-    VFS["cwd"] = "/"
+    _close_archives()
+    VFS["root"] = DirNode()
+    _reset_all_cwd()
+    _invalidate_paths()
+    _reset_grep_index()
+    SNAPSHOTS.clear()
+    VFS["dedup_files"] = VFS["dedup_bytes"] = 0
     VFS["loaded"] = False
     print("VFS сброшена к состоянию по умолчанию")
 
 
-def list_vfs_directory(path: str = None) -> list:
-    """Возвращает список файлов и папок в указанной директории VFS"""
-    if path is None:
-        path = VFS["cwd"]
+# атрибуты элементов сохраняемого архива (права Unix в старших 16 битах, 0x10 - папка в MS-DOS)
+_DIR_ATTR = (0o40755 << 16) | 0x10
+_FILE_ATTR = 0o644 << 16
+
+
+def _write_raw_member(zip_out: "zipfile.ZipFile", zinfo: "zipfile.ZipInfo", pieces) -> None:
+    """Записывает элемент из уже сжатых байтов, минуя распаковку и повторное сжатие.
+
+    У zipfile нет публичного способа записать сжатые данные, поэтому заголовок пишется сам,
+    а центральный каталог по filelist дописывает ZipFile.close(), как для обычных элементов.
+    """
+    zip_out._writecheck(zinfo)
+    zip_out._didModify = True
+    zinfo.header_offset = zip_out.fp.tell()
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zip_out.fp.write(zinfo.FileHeader(zip64))
+    for piece in pieces:
+        zip_out.fp.write(piece)
+    zip_out.start_dir = zip_out.fp.tell()
+    zip_out.filelist.append(zinfo)
+    zip_out.NameToInfo[zinfo.filename] = zinfo
+
+
+def _write_vfs_entry(zip_out: "zipfile.ZipFile", name: str, entry: FileEntry, date_time: tuple) -> bool:
+    """Записывает файл VFS в архив; True - сжатые байты скопированы из исходного архива"""
+    info = entry.info
+    zinfo = zipfile.ZipInfo(name, getattr(info, "date_time", None) or date_time)
+    zinfo.external_attr = getattr(info, "external_attr", 0) or _FILE_ATTR
+
+    if info is not None and entry.layer is not None and _raw_readable(info):
+        zinfo.compress_type = info.compress_type
+        zinfo.CRC = info.CRC
+        zinfo.compress_size = info.compress_size
+        zinfo.file_size = info.file_size
+        # Размеры записываются в локальный заголовок, дескриптор данных не нужен
+        zinfo.flag_bits = info.flag_bits & ~0x08
+        _write_raw_member(zip_out, zinfo, _iter_raw_pieces(entry.layer, info))
+        return True
 
-    # Нормализуем путь для поиска
-    if path == "/":
-        search_path = ""
-    else:
-        search_path = path.lstrip('/')
+    # Содержимого нет в исходном архиве в пригодном виде: сжимаем заново
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.file_size = _file_size(entry)
+    with zip_out.open(zinfo, 'w') as dst:
+        for chunk in _iter_file_chunks(entry):
+            dst.write(chunk)
+    return False
+
+
+def save_vfs_to_zip(zip_path: str) -> bool:
+    """Сохраняет текущее дерево VFS в новый ZIP-архив"""
+    zip_path = os.path.abspath(os.path.expanduser(zip_path))
+    sources = [layer["path"] for layer in VFS["layers"] if os.path.exists(layer["path"])]
+    if os.path.exists(zip_path) and any(os.path.samefile(zip_path, source) for source in sources):
+        # Из исходных архивов копируются сжатые данные по смещениям - перезаписывать их нельзя
+        print(f"vfs-save: нельзя перезаписать загруженный архив: {zip_path}")
+        return False
+    if not os.path.isdir(os.path.dirname(zip_path)):
+        # Иначе ошибка назвала бы временный файл, а не целевой путь
+        print(f"vfs-save: папка не существует: {os.path.dirname(zip_path)}")
+        return False
+    source = sources[0] if sources else None
 
-    items = set()
+    date_time = time.localtime(os.path.getmtime(source) if source and os.path.exists(source) else None)[:6]
+    files = copied = 0
+    tmp_path = None
+    try:
+        import tempfile
+
+        # Архив собирается во временном файле рядом с целевым и заменяет его только целиком
+        fd, tmp_path = tempfile.mkstemp(suffix=".zip.tmp", dir=os.path.dirname(zip_path))
+        os.close(fd)
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+            stack = [("", VFS["root"])]
+            while stack:
+                prefix, directory = stack.pop()
+                names = sorted(directory.children)
+                _touch(len(names))
+                if prefix:
+                    dir_info = zipfile.ZipInfo(prefix, date_time)
+                    dir_info.external_attr = _DIR_ATTR
+                    zip_out.writestr(dir_info, b"")
+                for name in names:
+                    child = directory.children[name]
+                    if not isinstance(child, DirNode):
+                        files += 1
+                        copied += _write_vfs_entry(zip_out, prefix + name, child, date_time)
+                stack.extend((prefix + name + '/', directory.children[name])
+                             for name in reversed(names) if isinstance(directory.children[name], DirNode))
+        os.replace(tmp_path, zip_path)
+        tmp_path = None
+    except (OSError, zipfile.BadZipFile, zlib.error) as e:
+        print(f"vfs-save: ошибка сохранения: {e}")
+        return False
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    # Проверяем все элементы VFS
-    for item_path in list(VFS["files"].keys()) + list(VFS["folders"]):
-        # Если элемент находится в искомой директории
-        if item_path.startswith(search_path):
-            # Получаем относительный путь
-            relative_path = item_path[len(search_path):].lstrip('/')
-            if not relative_path:
-                continue
+    print(f"VFS сохранена в: {zip_path}")
+    print(f"Файлов: {files}, скопировано без перепаковки: {copied}")
+    return True
 
-            # Разделяем на части
-            parts = relative_path.split('/')
-            if len(parts) > 1:
-                # Это вложенный элемент - добавляем первую папку
-                items.add(parts[0] + '/')
-            else:
-                # Это файл или папка в текущей директории
-                items.add(parts[0])
 
-    return sorted(list(items))
+def take_snapshot(name: str) -> None:
+    """Запоминает текущее дерево под именем: O(1), узлы становятся общими и неизменяемыми"""
+    SNAPSHOTS[name] = VFS["root"]
+    VFS["epoch"] += 1
+    print(f"Снимок '{name}' сохранён")
 
 
-def change_vfs_directory(new_path: str) -> bool:
-    """Меняет текущую директорию в VFS"""
-    if new_path.startswith('/'):
-        # Абсолютный путь
-        target_path = new_path
-    else:
-        # Относительный путь
-        if VFS["cwd"] == "/":
-            target_path = "/" + new_path
+def restore_snapshot(name: str) -> bool:
+    """Возвращает дерево к снимку без перезагрузки архива"""
+    root = SNAPSHOTS.get(name)
+    if root is None:
+        print(f"restore: снимок не найден: {name}")
+        return False
+    # Новое поколение: изменения после восстановления не затронут сам снимок
+    VFS["root"] = root
+    VFS["epoch"] += 1
+    _reset_all_cwd()
+    _invalidate_paths()
+    print(f"VFS восстановлена из снимка '{name}'")
+    return True
+
+
+def _same_content(a: FileEntry, b: FileEntry) -> bool:
+    if _file_size(a) != _file_size(b):
+        return False
+    if a.info is not None and b.info is not None:
+        return a.info.CRC == b.info.CRC
+    return bytes(_file_data(a)) == bytes(_file_data(b))
+
+
+def _diff_trees(old: DirNode, new: DirNode, prefix: str, changes: list) -> None:
+    """Различия двух деревьев; общие поддеревья (один и тот же узел) не обходятся"""
+    names = sorted(old.children.keys() | new.children.keys())
+    _touch(len(names))
+    for name in names:
+        a, b = old.children.get(name), new.children.get(name)
+        if a is b:
+            continue
+        path = prefix + name
+        a_dir, b_dir = isinstance(a, DirNode), isinstance(b, DirNode)
+        if a_dir and b_dir:
+            _diff_trees(a, b, path + '/', changes)
+        elif a is not None and b is not None and not a_dir and not b_dir:
+            if not _same_content(a, b):
+                changes.append(f"~ {path}")
         else:
-            target_path = VFS["cwd"].rstrip('/') + "/" + new_path
+            if a is not None:
+                changes.append(f"- {path}/" if a_dir else f"- {path}")
+            if b is not None:
+                changes.append(f"+ {path}/" if b_dir else f"+ {path}")
+
+
+def diff_snapshots(old_name: str, new_name: str | None = None) -> bool:
+    """Выводит различия снимков (без второго имени - снимка и текущего дерева)"""
+    roots = []
+    for name in (old_name, new_name):
+        if name is None:
+            roots.append(VFS["root"])
+        elif name in SNAPSHOTS:
+            roots.append(SNAPSHOTS[name])
+        else:
+            print(f"diff: снимок не найден: {name}")
+            return False
+    changes = []
+    _diff_trees(roots[0], roots[1], "/", changes)
+    for change in changes:
+        print(change)
+    if not changes:
+        print("Различий нет")
+    return True
 
-    # Нормализуем путь
-    if target_path != "/" and not target_path.endswith('/'):
-        target_path += '/'
 
-    # Проверяем существование пути
-    search_path = target_path.lstrip('/')
-    path_exists = False
+def list_vfs_directory(path: str = None) -> list:
+    """Возвращает список файлов и папок в указанной директории VFS"""
+    if path is None:
+        path = _session()["cwd"]
 
-    # Проверяем есть ли файлы или папки в этой директории
-    for item_path in list(VFS["files"].keys()) + list(VFS["folders"]):
-        if item_path.startswith(search_path) or item_path == search_path.rstrip('/'):
-            path_exists = True
-            break
+    _, node = _resolve(path)
+    if not isinstance(node, DirNode):
+        return []
+    _touch(len(node.children))
+
+    # Папки помечаются завершающим слешем
+    return sorted(name + '/' if isinstance(child, DirNode) else name
+                  for name, child in node.children.items())
+
+
+def change_vfs_directory(new_path: str) -> bool:
+    """Меняет текущую директорию в VFS"""
+    parts, node = _resolve(new_path)
+    target_path = _dir_path(parts)
 
     # ДОПОЛНИТЕЛЬНАЯ ПРОВЕРКА: не позволяем переходить в файлы
-    # Убираем слеш в конце и проверяем не файл ли это
-    clean_path = search_path.rstrip('/')
-    if clean_path in VFS["files"]:
+    if _is_file(node):
         print(f"Ошибка: '{new_path}' является файлом, а не директорией")
         return False
 
-    if path_exists:
-        VFS["cwd"] = target_path
+    if node is not None:
+        _session()["cwd"] = target_path
         return True
     else:
         print(f"Ошибка: директория не существует: {target_path}")
@@ -167,25 +1325,16 @@ def change_vfs_directory(new_path: str) -> bool:
 
 def cat_file(filename: str) -> bool:
     """Выводит содержимое файла из VFS"""
-    # Получаем абсолютный путь к файлу
-    if filename.startswith('/'):
-        abs_path = filename.lstrip('/')
-    else:
-        if VFS["cwd"] == "/":
-            abs_path = filename
+    _, entry = _resolve(filename)
+    if _is_file(entry):
+        if _file_is_text(entry):
+            # Файл копируется в stdout блоками
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            for chunk in _iter_file_chunks(entry):
+                sys.stdout.write(decoder.decode(chunk))
+            sys.stdout.write(decoder.decode(b"", final=True) + "\n")
         else:
-            abs_path = VFS["cwd"].lstrip('/') + filename
-
-    # Убираем завершающий слеш если он есть (когда пользователь использовал cd на файле)
-    abs_path = abs_path.rstrip('/')
-
-    # Ищем файл в VFS
-    if abs_path in VFS["files"]:
-        content = VFS["files"][abs_path]
-        if content.startswith("[base64]"):
             print(f"Файл {filename} содержит бинарные данные")
-        else:
-            print(content)
         return True
     else:
         print(f"cat: {filename}: No such file or directory")
@@ -198,28 +1347,16 @@ def rev_text(text: str) -> str:
 
 def rev_file(filename: str) -> bool:
     """Выводит содержимое файла в обратном порядке"""
-    # Получаем абсолютный путь к файлу
-    if filename.startswith('/'):
-        abs_path = filename.lstrip('/')
-    else:
-        if VFS["cwd"] == "/":
-            abs_path = filename
-        else:
-            abs_path = VFS["cwd"].lstrip('/') + filename
-
-    # Убираем завершающий слеш если он есть
-    abs_path = abs_path.rstrip('/')
-
-    # Ищем файл в VFS
-    if abs_path in VFS["files"]:
-        content = VFS["files"][abs_path]
-        if content.startswith("[base64]"):
+    _, entry = _resolve(filename)
+    if _is_file(entry):
+        if not _file_is_text(entry):
             print(f"rev: {filename}: Binary file")
             return False
         else:
-            # Переворачиваем содержимое файла
-            reversed_content = rev_text(content)
-            print(reversed_content)
+            # Переворачиваем содержимое файла блоками с конца
+            for chunk in _iter_reversed_text(entry):
+                sys.stdout.write(chunk)
+            sys.stdout.write("\n")
             return True
     else:
         print(f"rev: {filename}: No such file or directory")
@@ -228,293 +1365,1410 @@ def rev_file(filename: str) -> bool:
 
 def move_file(source: str, destination: str) -> bool:
     """Перемещает или переименовывает файл/папку в VFS"""
-    # Получаем абсолютные пути для источника
-    if source.startswith('/'):
-        source_path = source.lstrip('/')
-    else:
-        if VFS["cwd"] == "/":
-            source_path = source
-        else:
-            source_path = VFS["cwd"].lstrip('/') + source
-    source_path = source_path.rstrip('/')
-
-    # Получаем абсолютные пути для назначения
-    if destination.startswith('/'):
-        dest_path = destination.lstrip('/')
-    else:
-        if VFS["cwd"] == "/":
-            dest_path = destination
-        else:
-            dest_path = VFS["cwd"].lstrip('/') + destination
-    dest_path = dest_path.rstrip('/')
+    source_parts, node = _resolve(source)
+    dest_parts, dest_node = _resolve(destination)
 
-    # Проверяем существование источника
-    source_is_file = source_path in VFS["files"]
-    source_is_folder = source_path + '/' in VFS["folders"]
-
-    if not source_is_file and not source_is_folder:
+    # Проверяем существование источника (корень переместить нельзя)
+    if node is None or not source_parts:
         print(f"mv: cannot move '{source}': No such file or directory")
         return False
+    source_is_folder = isinstance(node, DirNode)
 
-    # Проверяем не пытаемся ли переместить папку в файл
-    if source_is_folder and dest_path in VFS["files"]:
-        print(f"mv: cannot overwrite non-directory '{destination}' with directory '{source}'")
+    # Если назначение существует и это папка, перемещаем в неё
+    target = destination
+    if isinstance(dest_node, DirNode):
+        dest_parts = dest_parts + (source_parts[-1],)
+        dest_node = dest_node.children.get(source_parts[-1])
+        target = f"{destination.rstrip('/')}/{source_parts[-1]}"
+
+    # Проверяем не пытаемся ли переместить папку в файл (в том числе в файл внутри папки назначения)
+    if source_is_folder and _is_file(dest_node):
+        print(f"mv: cannot overwrite non-directory '{target}' with directory '{source}'")
         return False
 
-    # Если назначение существует и это папка, перемещаем в неё
-    if dest_path + '/' in VFS["folders"]:
-        # Получаем имя источника
-        source_name = source_path.split('/')[-1]
-        dest_path = dest_path.rstrip('/') + '/' + source_name
-
-    # Перемещаем файл
-    if source_is_file:
-        VFS["files"][dest_path] = VFS["files"][source_path]
-        del VFS["files"][source_path]
-
-        # Обновляем текущую директорию если она была затронута
-        if VFS["cwd"].lstrip('/').startswith(source_path + '/'):
-            new_cwd = VFS["cwd"].lstrip('/').replace(source_path, dest_path, 1)
-            VFS["cwd"] = '/' + new_cwd if new_cwd else '/'
-
-    # Перемещаем папку
-    elif source_is_folder:
-        # Добавляем новую папку
-        VFS["folders"].add(dest_path + '/')
-        VFS["folders"].remove(source_path + '/')
-
-        # Перемещаем все файлы и подпапки
-        files_to_move = []
-        folders_to_move = []
-
-        for file_path in list(VFS["files"].keys()):
-            if file_path.startswith(source_path + '/'):
-                files_to_move.append(file_path)
-
-        for folder_path in list(VFS["folders"]):
-            if folder_path.startswith(source_path + '/') and folder_path != source_path + '/':
-                folders_to_move.append(folder_path)
-
-        # Перемещаем файлы
-        for file_path in files_to_move:
-            new_file_path = file_path.replace(source_path, dest_path, 1)
-            VFS["files"][new_file_path] = VFS["files"][file_path]
-            del VFS["files"][file_path]
-
-        # Перемещаем подпапки
-        for folder_path in folders_to_move:
-            new_folder_path = folder_path.replace(source_path, dest_path, 1)
-            VFS["folders"].add(new_folder_path)
-            VFS["folders"].remove(folder_path)
-
-        # Обновляем текущую директорию если она была затронута
-        if VFS["cwd"].lstrip('/').startswith(source_path + '/'):
-            new_cwd = VFS["cwd"].lstrip('/').replace(source_path, dest_path, 1)
-            VFS["cwd"] = '/' + new_cwd if new_cwd else '/'
+    if dest_parts == source_parts:
+        return True
+
+    # Папку нельзя переместить внутрь неё самой
+    if source_is_folder and dest_parts[:len(source_parts)] == source_parts:
+        print(f"mv: cannot move '{source}' to a subdirectory of itself, '{destination}'")
+        return False
+
+    # Существующую папку заменяет только папка, и только если она пуста
+    if isinstance(dest_node, DirNode):
+        if not source_is_folder:
+            print(f"mv: cannot overwrite directory '{target}' with non-directory")
+            return False
+        if dest_node.children:
+            print(f"mv: cannot move '{source}' to '{target}': Directory not empty")
+            return False
+
+    # Недостающие папки назначения создаются, но файл на пути папкой не становится
+    dest_parent = VFS["root"]
+    existing = 0
+    for name in dest_parts[:-1]:
+        dest_parent = dest_parent.children.get(name)
+        if dest_parent is None:
+            break
+        if not isinstance(dest_parent, DirNode):
+            print(f"mv: cannot move '{source}' to '{destination}': Not a directory")
+            return False
+        existing += 1
+
+    # Перенос - перепривязка одного узла: поддерево не обходится, меняется только имя-ключ;
+    # итоги du поправляются приращениями вдоль двух путей
+    moved = _totals(node)
+    del _ensure_dir(source_parts[:-1]).children[source_parts[-1]]
+    _update_totals(source_parts[:-1], *(-value for value in moved))
+    dest_parent = _ensure_dir(dest_parts[:-1])
+    for depth in range(existing, len(dest_parts) - 1):
+        _update_totals(dest_parts[:depth], 0, 1, 0)
+    replaced = dest_parent.children.get(dest_parts[-1])
+    if replaced is not None:
+        _update_totals(dest_parts[:-1], *(-value for value in _totals(replaced)))
+    dest_parent.children[dest_parts[-1]] = node
+    _update_totals(dest_parts[:-1], *moved)
+    _invalidate_paths()
+
+    # Текущая директория внутри перенесённой папки (в любом сеансе): заменяем префикс пути
+    if source_is_folder:
+        source_prefix = _dir_path(source_parts)
+        dest_prefix = _dir_path(dest_parts)
+        for session in list(SESSIONS.values()):
+            if session["cwd"].startswith(source_prefix):
+                session["cwd"] = dest_prefix + session["cwd"][len(source_prefix):]
 
     return True
 
 
 def remove_directory(dirname: str) -> bool:
     """Удаляет пустую директорию из VFS"""
-    # Получаем абсолютный путь к директории
-    if dirname.startswith('/'):
-        abs_path = dirname.lstrip('/')
-    else:
-        if VFS["cwd"] == "/":
-            abs_path = dirname
-        else:
-            abs_path = VFS["cwd"].lstrip('/') + dirname
-
-    # Добавляем завершающий слеш для папки
-    if not abs_path.endswith('/'):
-        abs_path += '/'
+    parts, node = _resolve(dirname)
 
-    # Проверяем существование папки
-    if abs_path not in VFS["folders"]:
+    # Проверяем существование папки (корень удалить нельзя)
+    if not isinstance(node, DirNode) or not parts:
         print(f"rmdir: failed to remove '{dirname}': No such file or directory")
         return False
 
     # Проверяем что папка пуста
-    for file_path in VFS["files"]:
-        if file_path.startswith(abs_path):
-            print(f"rmdir: failed to remove '{dirname}': Directory not empty")
+    if node.children:
+        print(f"rmdir: failed to remove '{dirname}': Directory not empty")
+        return False
+
+    # Удаляем папку
+    del _ensure_dir(parts[:-1]).children[parts[-1]]
+    _update_totals(parts[:-1], 0, -1, 0)
+    _invalidate_paths()
+
+    # Если текущая директория (в любом сеансе) была удалена, возвращаемся в корень
+    removed_prefix = _dir_path(parts)
+    for session in list(SESSIONS.values()):
+        if session["cwd"].startswith(removed_prefix):
+            session["cwd"] = "/"
+
+    return True
+
+
+def _display_join(shown: str, name: str) -> str:
+    return shown + name if not shown or shown.endswith('/') else shown + '/' + name
+
+
+def list_recursive(path: str) -> bool:
+    """Рекурсивный вывод директорий (ls -R): заголовок каждой папки и её содержимое"""
+    _, node = _resolve(path)
+    if not isinstance(node, DirNode):
+        print(f"ls: cannot access '{path}': No such file or directory")
+        return False
+
+    stack = [(path, node)]
+    first = True
+    while stack:
+        shown, directory = stack.pop()
+        names = sorted(directory.children)
+        _touch(len(names))
+        if not first:
+            print()
+        first = False
+        lines = [f"{shown}:"]
+        subdirs = []
+        for name in names:
+            child = directory.children[name]
+            if isinstance(child, DirNode):
+                lines.append(name + '/')
+                subdirs.append((_display_join(shown, name), child))
+            else:
+                lines.append(name)
+        # Один вызов print на папку вместо строки на каждый элемент
+        print("\n".join(lines))
+        # Обход в глубину в алфавитном порядке, как у ls -R
+        stack.extend(reversed(subdirs))
+    return True
+
+
+def disk_usage(args: list[str]) -> bool:
+    """du [-s] [-d N] [ПУТЬ...]: байты и число файлов по папкам из итогов узлов"""
+    summarize, max_depth = False, None
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option == "-s":
+            summarize = True
+        elif option == "-d" and args and args[0].isdigit():
+            max_depth = int(args.pop(0))
+        else:
+            print(f"du: invalid option '{option}'")
+            return False
+    if summarize:
+        max_depth = 0
+
+    ok = True
+    for path in args or ["."]:
+        _, node = _resolve(path)
+        if node is None:
+            print(f"du: cannot access '{path}': No such file or directory")
+            ok = False
+            continue
+        if not isinstance(node, DirNode):
+            print(f"{_file_size(node)}\t1\t{path}")
+            continue
+        # Вывод как у du: вложенные папки раньше родительской; размеры не пересчитываются
+        lines = []
+        stack = [(path, node, 0)]
+        while stack:
+            shown, directory, depth = stack.pop()
+            lines.append(f"{directory.size}\t{directory.files}\t{shown}")
+            if max_depth is None or depth < max_depth:
+                names = sorted(directory.children)
+                _touch(len(names))
+                stack.extend((_display_join(shown, name), directory.children[name], depth + 1)
+                             for name in names if isinstance(directory.children[name], DirNode))
+        for line in reversed(lines):
+            print(line)
+    return ok
+
+
+def disk_free() -> None:
+    """df: итоги всей VFS и смонтированные архивы"""
+    root = VFS["root"]
+    print(f"{'Filesystem':<12} {'Files':>9} {'Dirs':>9} {'Bytes':>14}  Mounted on")
+    print(f"{VFS_NAME:<12} {root.files:>9} {root.dirs:>9} {root.size:>14}  /")
+    for layer in VFS["layers"]:
+        archive_size = os.path.getsize(layer["path"]) if os.path.exists(layer["path"]) else 0
+        print(f"{os.path.basename(layer['path']):<12} {'-':>9} {'-':>9} {archive_size:>14}  {layer['mount']}")
+
+
+# множители суффиксов размера в find -size (без суффикса - блоки по 512 байт)
+_SIZE_UNITS = {"c": 1, "b": 512, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def _parse_size_predicate(value: str):
+    """Разбирает аргумент -size ([+-]N[cbkMG]) в функцию проверки размера в байтах"""
+    match = re.fullmatch(r"([+-]?)(\d+)([cbkMG]?)", value)
+    if not match:
+        return None
+    sign, count, suffix = match.group(1), int(match.group(2)), match.group(3) or "b"
+    unit = _SIZE_UNITS[suffix]
+
+    def check(size: int) -> bool:
+        # Как в find: размер округляется вверх до целых единиц
+        units = -(-size // unit)
+        if sign == "+":
+            return units > count
+        if sign == "-":
+            return units < count
+        return units == count
+
+    return check
+
+
+def find_entries(args: list[str]) -> bool:
+    """find [ПУТЬ...] [-name Ш] [-iname Ш] [-type f|d] [-size [+-]N[cbkMG]] [-maxdepth N] [-mindepth N]"""
+    paths = []
+    while args and not args[0].startswith('-'):
+        paths.append(args.pop(0))
+    paths = paths or ["."]
+
+    name_pattern = iname_pattern = kind = size_check = None
+    max_depth, min_depth = None, 0
+    while args:
+        option = args.pop(0)
+        if option not in ("-name", "-iname", "-type", "-size", "-maxdepth", "-mindepth"):
+            print(f"find: unknown predicate '{option}'")
             return False
+        if not args:
+            print(f"find: missing argument to '{option}'")
+            return False
+        value = args.pop(0)
+        if option == "-name":
+            name_pattern = value
+        elif option == "-iname":
+            iname_pattern = value.lower()
+        elif option == "-type":
+            if value not in ("f", "d"):
+                print(f"find: Unknown argument to -type: {value}")
+                return False
+            kind = value
+        elif option == "-size":
+            size_check = _parse_size_predicate(value)
+            if size_check is None:
+                print(f"find: invalid argument '{value}' to '-size'")
+                return False
+        else:
+            if not value.isdigit():
+                print(f"find: invalid argument '{value}' to '{option}'")
+                return False
+            if option == "-maxdepth":
+                max_depth = int(value)
+            else:
+                min_depth = int(value)
 
-    for folder_path in VFS["folders"]:
-        if folder_path.startswith(abs_path) and folder_path != abs_path:
-            print(f"rmdir: failed to remove '{dirname}': Directory not empty")
+    def matches(name: str, node, depth: int) -> bool:
+        if depth < min_depth:
+            return False
+        is_dir = isinstance(node, DirNode)
+        if kind == "f" and is_dir or kind == "d" and not is_dir:
+            return False
+        if name_pattern is not None and not fnmatch.fnmatchcase(name, name_pattern):
+            return False
+        if iname_pattern is not None and not fnmatch.fnmatchcase(name.lower(), iname_pattern):
             return False
+        if size_check is not None and not size_check(0 if is_dir else _file_size(node)):
+            return False
+        return True
 
-    # Удаляем папку
-    VFS["folders"].remove(abs_path)
+    ok = True
+    for path in paths:
+        parts, start = _resolve(path)
+        if start is None:
+            print(f"find: '{path}': No such file or directory")
+            ok = False
+            continue
+        start_name = parts[-1] if parts else "/"
+        stack = [(path, start_name, start, 0)]
+        while stack:
+            shown, name, node, depth = stack.pop()
+            if matches(name, node, depth):
+                print(shown)
+            # Глубже -maxdepth не спускаемся: поддерево отсекается целиком
+            if isinstance(node, DirNode) and (max_depth is None or depth < max_depth):
+                names = sorted(node.children, reverse=True)
+                _touch(len(names))
+                stack.extend((_display_join(shown, child_name), child_name, node.children[child_name], depth + 1)
+                             for child_name in names)
+    return ok
+
+
+# Триграммный индекс содержимого для grep: триграмма (байты текста в нижнем регистре) -> файлы.
+# Ключи - сами FileEntry, поэтому mv (перенос узла) индекс не меняет.
+# Бинарные файлы не индексируются (в них слишком много разных триграмм) и просматриваются всегда.
+GREP_INDEX = {"trigrams": {}, "indexed": set(), "binary": set()}
+_GREP_INDEX_LOCK = threading.Lock()
+
+# с какого числа нераспакованных файлов поиск идёт в пуле потоков. Разбор строк и re держат GIL,
+# поэтому по данным в памяти потоки только мешают; выигрыш даёт лишь распаковка zlib
+GREP_PARALLEL_MIN = 64
+
+
+def _reset_grep_index() -> None:
+    with _GREP_INDEX_LOCK:
+        GREP_INDEX["trigrams"] = {}
+        GREP_INDEX["indexed"] = set()
+        GREP_INDEX["binary"] = set()
+
+
+def _trigrams(text: bytes) -> set:
+    """Триграммы текста; повторяющиеся строки (частые в логах) разбираются один раз"""
+    grams = set()
+    for line in set(text.split(b"\n")):
+        grams.update(line[i:i + 3] for i in range(len(line) - 2))
+    return grams
+
+
+def _entry_trigrams(entry: FileEntry) -> set | None:
+    """Триграммы файла в нижнем регистре; файл читается блоками, а не целиком"""
+    if not _file_is_text(entry):
+        return None
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    grams = set()
+    tail = b""
+    for chunk in _iter_file_chunks(entry):
+        piece = tail + decoder.decode(chunk).lower().encode()
+        grams |= _trigrams(piece)
+        # Два последних байта переходят в следующий блок: триграмма на стыке не теряется
+        tail = piece[-2:]
+    grams |= _trigrams(tail + decoder.decode(b"", final=True).lower().encode())
+    return grams
+
+
+def _required_literals(pattern: str) -> list[str]:
+    """Подстроки, которые обязательно есть в каждой строке-совпадении простого регулярного выражения.
+
+    Для шаблонов с группами и альтернативами возвращает пустой список (индекс не применяется).
+    """
+    if '|' in pattern or '(' in pattern:
+        return []
+    runs, current = [], []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum():
+                current.append(escaped)
+            elif escaped in ('d', 'D', 'w', 'W', 's', 'S', 'b', 'B'):
+                # Класс символов или граница - не литерал
+                runs.append(''.join(current))
+                current = []
+            else:
+                # \x41, \u0041, \N{...}, \1 и т.п. занимают больше двух символов: индекс не применяется
+                return []
+            i += 2
+            continue
+        if ch in '*?{':
+            # Предыдущий символ необязателен (после другого квантификатора current уже пуст)
+            if current:
+                current.pop()
+            runs.append(''.join(current))
+            current = []
+            if ch == '{':
+                close = pattern.find('}', i)
+                i = close if close != -1 else i
+        elif ch in '+.^$':
+            runs.append(''.join(current))
+            current = []
+        elif ch == '[':
+            runs.append(''.join(current))
+            current = []
+            # Пропускаем класс символов целиком; ']' сразу после '[' или '[^' - литерал
+            j = i + 1
+            if pattern[j:j + 1] == '^':
+                j += 1
+            if pattern[j:j + 1] == ']':
+                j += 1
+            # Экранированная '\]' класс не закрывает
+            while j < len(pattern) and pattern[j] != ']':
+                j += 2 if pattern[j] == '\\' else 1
+            if j >= len(pattern):
+                return []
+            i = j
+        else:
+            current.append(ch)
+        i += 1
+    runs.append(''.join(current))
+    return [run for run in runs if len(run) >= 3]
+
+
+def _grep_candidates(entries: list, pattern: str, fixed: bool, jobs: int):
+    """Файлы, в которых может быть совпадение по триграммному индексу; None - индекс неприменим"""
+    literals = [pattern] if fixed else _required_literals(pattern)
+    needed = set()
+    for literal in literals:
+        needed |= _trigrams(literal.lower().encode())
+    if not needed:
+        return None
 
-    # Если текущая директория была удалена, возвращаемся в корень
-    if VFS["cwd"].lstrip('/').startswith(abs_path.rstrip('/')):
-        VFS["cwd"] = "/"
+    # Индекс достраивается лениво: только по тем файлам, где grep уже искал
+    missing = [entry for entry in entries if entry not in GREP_INDEX["indexed"]]
+    if missing:
+        if jobs > 1 and sum(map(_needs_inflate, missing)) >= GREP_PARALLEL_MIN:
+            from concurrent.futures import ThreadPoolExecutor
 
-    return True
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                grams = list(pool.map(_entry_trigrams, missing))
+        else:
+            grams = [_entry_trigrams(entry) for entry in missing]
+        with _GREP_INDEX_LOCK:
+            trigrams = GREP_INDEX["trigrams"]
+            for entry, entry_grams in zip(missing, grams):
+                if entry_grams is None:
+                    GREP_INDEX["binary"].add(entry)
+                else:
+                    for gram in entry_grams:
+                        trigrams.setdefault(gram, set()).add(entry)
+                GREP_INDEX["indexed"].add(entry)
+
+    with _GREP_INDEX_LOCK:
+        postings = sorted((GREP_INDEX["trigrams"].get(gram, set()) for gram in needed), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:]) | GREP_INDEX["binary"]
+    _touch(len(needed))
+    return candidates
+
+
+def _iter_line_blocks(entry: FileEntry):
+    """Содержимое файла блоками из целых строк (каждый блок, кроме последнего, кончается переводом строки)"""
+    tail = b""
+    for chunk in _iter_file_chunks(entry):
+        block = tail + bytes(chunk)
+        cut = block.rfind(b"\n") + 1
+        tail = block[cut:]
+        if cut:
+            yield block[:cut]
+    if tail:
+        yield tail
+
+
+def _grep_entry(entry: FileEntry, shown: str, regex, options: dict) -> list[str]:
+    """Строки вывода grep для одного файла"""
+    prefix = shown + ":" if options["with_names"] else ""
+    is_text = _file_is_text(entry)
+    output = []
+    lineno = 0
+    for block in _iter_line_blocks(entry):
+        text = block.decode('utf-8', errors='replace')
+        # Быстрая проверка всего блока: строки разбираются только там, где есть совпадение
+        if options["block_regex"] is not None and options["block_regex"].search(text) is None:
+            lineno += text.count("\n")
+            continue
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop()
+        for line in lines:
+            lineno += 1
+            if regex.search(line) is None:
+                continue
+            if not is_text:
+                return [f"Binary file {shown} matches"]
+            if options["names_only"]:
+                return [shown]
+            output.append(f"{prefix}{lineno}:{line}" if options["line_numbers"] else prefix + line)
+    return output
+
+
+def _grep_files(path: str, recursive: bool) -> list | None:
+    """(показываемый путь, FileEntry) для аргумента grep; None - ошибка уже выведена"""
+    _, node = _resolve(path)
+    if node is None:
+        print(f"grep: {path}: No such file or directory")
+        return None
+    if _is_file(node):
+        return [(path, node)]
+    if not recursive:
+        print(f"grep: {path}: Is a directory")
+        return None
+
+    files = []
+    stack = [(path, node)]
+    while stack:
+        shown, directory = stack.pop()
+        names = sorted(directory.children, reverse=True)
+        _touch(len(names))
+        for name in names:
+            child = directory.children[name]
+            if isinstance(child, DirNode):
+                stack.append((_display_join(shown, name), child))
+        # Файлы папки - до её подпапок, всё в алфавитном порядке
+        files.extend((_display_join(shown, name), directory.children[name])
+                     for name in reversed(names) if _is_file(directory.children[name]))
+    return files
+
+
+def _parse_grep_args(args: list[str]) -> tuple | None:
+    """Разбирает аргументы grep: (флаги, шаблон, пути, регулярное выражение); None - ошибка уже выведена"""
+    flags = set()
+    while args and args[0].startswith('-') and len(args[0]) > 1:
+        option = args.pop(0)
+        if option == "--":
+            break
+        for flag in option[1:]:
+            if flag not in "rinlF":
+                print(f"grep: invalid option -- '{flag}'")
+                return None
+            flags.add(flag)
+    if not args:
+        print("Usage: grep [-r] [-i] [-n] [-l] [-F] PATTERN [PATH...]")
+        return None
+
+    pattern, paths = args[0], args[1:]
+    try:
+        regex = re.compile(re.escape(pattern) if "F" in flags else pattern,
+                           re.IGNORECASE if "i" in flags else 0)
+    except re.error as e:
+        print(f"grep: неверный шаблон: {e}")
+        return None
+    return flags, pattern, paths, regex
+
+
+def grep_files(args: list[str]) -> bool:
+    """grep [-r] [-i] [-n] [-l] [-F] ШАБЛОН [ПУТЬ...]"""
+    parsed = _parse_grep_args(args)
+    if parsed is None:
+        return False
+    flags, pattern, paths, regex = parsed
+    if not paths:
+        if "r" not in flags:
+            print("grep: не указан файл (без -r поиск идёт только по заданным путям)")
+            return False
+        paths = ["."]
+
+    ok = True
+    files = []
+    for path in paths:
+        found = _grep_files(path, "r" in flags)
+        if found is None:
+            ok = False
+        else:
+            files.extend(found)
+
+    jobs = CONFIG["grep_jobs"]
+    if CONFIG["grep_index"] and files:
+        candidates = _grep_candidates([entry for _, entry in files], pattern, "F" in flags, jobs)
+        if candidates is not None:
+            files = [(shown, entry) for shown, entry in files if entry in candidates]
+
+    options = {
+        "with_names": "r" in flags or len(paths) > 1,
+        "line_numbers": "n" in flags,
+        "names_only": "l" in flags,
+        # В блоке из многих строк ^ и $ должны совпадать на границах строк (MULTILINE);
+        # у \A и \Z такого режима нет - для них блок не проверяется
+        "block_regex": (re.compile(regex.pattern, regex.flags | re.MULTILINE)
+                        if "\\A" not in pattern and "\\Z" not in pattern else None),
+    }
+
+    def search(item):
+        return _grep_entry(item[1], item[0], regex, options)
+
+    if jobs > 1 and sum(_needs_inflate(entry) for _, entry in files) >= GREP_PARALLEL_MIN:
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Потоки только распаковывают и ищут; вывод идёт из потока сеанса в исходном порядке файлов
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            results = pool.map(search, files)
+            for lines in results:
+                for line in lines:
+                    print(line)
+    else:
+        for item in files:
+            for line in search(item):
+                print(line)
+    return ok
 
 
 # допустимое имя переменной окружения
 _VAR_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
 
 
-def _expand_exact_env_ref(token: str) -> str:
+def _env_ref_name(token: str) -> str | None:
+    """Имя переменной, если токен целиком ссылка на неё ($X, ${X}, %X%), иначе None"""
     if token.startswith("${") and token.endswith("}") and len(token) > 3:
         name = token[2:-1]
-        if _VAR_NAME.match(name):
-            return os.environ.get(name, token)
-        return token
-
-    if token.startswith("$") and len(token) > 1 and "{" not in token:
+    elif token.startswith("$") and len(token) > 1 and "{" not in token:
         name = token[1:]
-        if _VAR_NAME.match(name):
-            return os.environ.get(name, token)
-        return token
-
-    if token.startswith("%") and token.endswith("%") and len(token) > 2:
+    elif token.startswith("%") and token.endswith("%") and len(token) > 2:
         name = token[1:-1]
-        if _VAR_NAME.match(name):
-            return os.environ.get(name, token)
-        return token
-
-    low = token.lower()
-    if low.startswith("$env:") and len(token) > 5:
+    elif token.lower().startswith("$env:") and len(token) > 5:
         name = token[5:]
-        if _VAR_NAME.match(name):
-            return os.environ.get(name, token)
-        return token
+    else:
+        return None
+    return name if _VAR_NAME.match(name) else None
+
 
-    return token
+def _expand_exact_env_ref(token: str) -> str:
+    name = _env_ref_name(token)
+    return token if name is None else os.environ.get(name, token)
+
+
+# разобранные строки команд: строка -> (имена переменных, их значения, токены, есть ли шаблоны)
+PARSE_CACHE_SIZE = 4096
+_PARSE_CACHE = OrderedDict()
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def _parse_tokens(line: str):
+    """Токены строки после подстановки переменных; повторная строка берётся из кэша"""
+    with _PARSE_CACHE_LOCK:
+        entry = _PARSE_CACHE.get(line)
+        if entry is not None:
+            _PARSE_CACHE.move_to_end(line)
+    # Запись устарела, если изменилась любая из подставленных переменных окружения
+    if entry is not None and tuple(os.environ.get(name) for name in entry[0]) == entry[1]:
+        return entry[2], entry[3]
+
+    tokens = shlex.split(line, posix=True)
+    names = [_env_ref_name(token) for token in tokens]
+    refs = tuple(name for name in names if name)
+    parts = tuple(token if name is None else os.environ.get(name, token)
+                  for token, name in zip(tokens, names))
+    magic = len(parts) > 1 and any(_has_magic(p) for p in parts[1:])
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE[line] = (refs, tuple(os.environ.get(name) for name in refs), parts, magic)
+        if len(_PARSE_CACHE) > PARSE_CACHE_SIZE:
+            _PARSE_CACHE.popitem(last=False)
+    return parts, magic
 
 
 def parse_command(line: str) -> list[str]:
+    if os.name == "nt":
+        home = os.environ.get("HOME") or os.environ.get("USERPROFILE")
+        if home:
+            os.environ.setdefault("HOME", home)
+
     try:
-        parts = shlex.split(line, posix=True)
+        parts, magic = _parse_tokens(line)
     except ValueError as e:
         print(f"Ошибка парсера: {e}")
         return []
 
-    if os.name == "nt":
-        home = os.environ.get("HOME") or os.environ.get("USERPROFILE")
-        if home:
-            os.environ.setdefault("HOME", home)
+    # Шаблоны раскрываются каждый раз: результат зависит от текущего дерева и cwd
+    if magic and VFS["loaded"]:
+        return [parts[0]] + _expand_globs(line, list(parts[1:]))
+    return list(parts)
+
+
+_MAGIC = re.compile(r"[*?\[]")
+_QUOTED = re.compile(r"\"[^\"]*\"|'[^']*'")
+
 
-    return [_expand_exact_env_ref(p) for p in parts]
+def _has_magic(token: str) -> bool:
+    return _MAGIC.search(token) is not None
+
+
+def _expand_globs(line: str, args: list[str]) -> list[str]:
+    """Раскрывает шаблоны в аргументах по VFS; шаблоны в кавычках и без совпадений остаются как есть"""
+    # Кавычки видны только в исходных токенах: по ним определяем, какие шаблоны раскрывать
+    try:
+        raw = shlex.split(line, posix=False)[1:]
+    except ValueError:
+        raw = None
+    if raw is None or len(raw) != len(args):
+        raw = args
+
+    expanded = []
+    # Обход дерева под блокировкой чтения: разбор строки идёт вне блокировки команды
+    with VFS_LOCK.read():
+        for token, raw_token in zip(args, raw):
+            matches = _glob(token) if _has_magic(_QUOTED.sub("", raw_token)) else None
+            expanded.extend(matches or [token])
+    return expanded
+
+
+def _glob(pattern: str) -> list[str]:
+    """Совпадения шаблона в VFS; папки, не подходящие под очередной компонент, не обходятся"""
+    only_dirs = pattern.endswith('/')
+    if pattern.startswith('/'):
+        matches = [("/", ())]
+    else:
+        matches = [("", _normalize_path(".", _session()["cwd"]))]
+
+    for component in (c for c in pattern.split('/') if c):
+        found = []
+        for shown, parts in matches:
+            node = _lookup_node(parts)
+            if not isinstance(node, DirNode):
+                continue
+            if component == '..':
+                found.append((_display_join(shown, component), parts[:-1]))
+            elif component == '.' or not _has_magic(component):
+                if component == '.' or component in node.children:
+                    found.append((_display_join(shown, component), parts if component == '.' else parts + (component,)))
+            else:
+                # Скрытые имена совпадают только с шаблоном, начинающимся с точки
+                names = sorted(name for name in node.children
+                               if fnmatch.fnmatchcase(name, component)
+                               and (component.startswith('.') or not name.startswith('.')))
+                _touch(len(node.children))
+                found.extend((_display_join(shown, name), parts + (name,)) for name in names)
+        matches = found
+        if not matches:
+            return []
+
+    if only_dirs:
+        return [shown + '/' for shown, parts in matches if isinstance(_lookup_node(parts), DirNode)]
+    return [shown for shown, _ in matches]
+
+
+def _split_pipeline(line: str) -> tuple[list[str], str | None, bool]:
+    """Делит строку по | и > вне кавычек: (команды, файл перенаправления или None, дописывать ли)"""
+    segments, current = [], []
+    target, append = None, False
+    quote = None
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        if quote:
+            if ch == quote:
+                quote = None
+            elif ch == '\\' and quote == '"':
+                current.append(line[i:i + 2])
+                i += 2
+                continue
+        elif ch in "'\"":
+            quote = ch
+        elif ch == '\\':
+            current.append(line[i:i + 2])
+            i += 2
+            continue
+        elif ch in "|>":
+            if target is not None:
+                raise ValueError("перенаправление > допускается только в конце строки")
+            segment = "".join(current).strip()
+            if not segment:
+                raise ValueError(f"нет команды перед '{ch}'")
+            segments.append(segment)
+            current = []
+            if ch == '>':
+                append = line.startswith('>>', i)
+                target = ""
+                i += 1 if append else 0
+            i += 1
+            continue
+        current.append(ch)
+        i += 1
+
+    rest = "".join(current).strip()
+    if target is None:
+        if not rest:
+            raise ValueError("нет команды после '|'")
+        segments.append(rest)
+        return segments, None, False
+    if not rest:
+        raise ValueError("нет имени файла после '>'")
+    return segments, rest, append
+
+
+# глубина очереди между стадиями конвейера (в блоках до CHUNK_SIZE символов)
+PIPE_DEPTH = 16
+# Размер блока вывода в пакетном режиме (--batch), символов
+OUTPUT_BLOCK = 1 << 20
+
+
+class _PipeOutput:
+    """Вывод команды внутри конвейера: текст уходит следующей стадии через ограниченную очередь"""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=PIPE_DEPTH)
+        # следующая стадия перестала читать
+        self.closed = False
+        self._parts = []
+        self._size = 0
+
+    def write(self, text: str) -> int:
+        if self.closed:
+            raise BrokenPipeError("следующая стадия конвейера завершилась")
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= CHUNK_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        if self._parts and not self.closed:
+            chunk = "".join(self._parts)
+            self._parts, self._size = [], 0
+            # Очередь ограничена: быстрая команда ждёт медленного читателя
+            self.queue.put(chunk)
+
+    def finish(self) -> None:
+        self.flush()
+        self.queue.put(None)
+
+
+def _install_session_stdout() -> None:
+    # Вывод команд-стадий перенаправляется через поток сеанса
+    if not isinstance(sys.stdout, _SessionStdout):
+        sys.stdout = _SessionStdout(sys.stdout)
+
+
+def _command_stage(cmd: str, args: list[str]):
+    """Стадия из обычной команды: она выполняется в своём потоке, её вывод читается блоками"""
+    _install_session_stdout()
+    out = _PipeOutput()
+    # Как подоболочка: своя копия текущей директории, cd в конвейере на сеанс не влияет
+    session = {"cwd": _session()["cwd"], "out": out}
+
+    def run():
+        SESSION.set(session)
+        try:
+            _dispatch(cmd, args)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            if not out.closed:
+                print(f"Ошибка выполнения команды: {e}")
+        finally:
+            out.finish()
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    worker.start()
+    finished = False
+    try:
+        while (chunk := out.queue.get()) is not None:
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            # Читатель остановился раньше: команда получит BrokenPipeError при следующей записи
+            out.closed = True
+            while out.queue.get() is not None:
+                pass
+        worker.join()
+
+
+def _iter_lines(chunks):
+    """Разбивает поток текстовых блоков на строки (с переводом строки, кроме, может быть, последней)"""
+    tail = ""
+    for chunk in chunks:
+        lines = (tail + chunk).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if tail:
+        yield tail
+
+
+def _pipe_cat(args: list[str], upstream):
+    """cat в конвейере: файлы блоками или вход без изменений"""
+    if not args:
+        if upstream is not None:
+            yield from upstream
+        return
+    for name in args:
+        _, entry = _resolve(name)
+        if not _is_file(entry):
+            print(f"cat: {name}: No such file or directory")
+            continue
+        if not _file_is_text(entry):
+            yield f"Файл {name} содержит бинарные данные\n"
+            continue
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for chunk in _iter_file_chunks(entry):
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+
+def _pipe_rev(args: list[str], upstream):
+    """rev в конвейере: вход переворачивается построчно, как у rev(1); файлы и текст - как у команды rev"""
+    if not args:
+        if upstream is not None:
+            for line in _iter_lines(upstream):
+                yield line[-2::-1] + "\n" if line.endswith("\n") else line[::-1]
+        return
+    for arg in args:
+        _, entry = _resolve(arg)
+        if not _is_file(entry):
+            yield rev_text(arg) + "\n"
+        elif not _file_is_text(entry):
+            print(f"rev: {arg}: Binary file")
+        else:
+            yield from _iter_reversed_text(entry)
+            yield "\n"
+
+
+def _pipe_grep(args: list[str], upstream):
+    """grep в конвейере: без путей фильтрует строки входа"""
+    parsed = _parse_grep_args(list(args))
+    if parsed is None:
+        return
+    flags, _, paths, regex = parsed
+    if paths or "r" in flags or upstream is None:
+        yield from _command_stage("grep", args)
+        return
+    for number, line in enumerate(_iter_lines(upstream), 1):
+        text = line[:-1] if line.endswith("\n") else line
+        if regex.search(text) is None:
+            continue
+        if "l" in flags:
+            yield "(standard input)\n"
+            return
+        yield f"{number}:{text}\n" if "n" in flags else text + "\n"
+
+
+def _pipe_head(args: list[str], upstream):
+    """head [-n N] [ФАЙЛ...]: первые N строк; дальше вход не читается"""
+    count = 10
+    if args and args[0] == "-n" and len(args) > 1 and args[1].isdigit():
+        count, args = int(args[1]), args[2:]
+    elif args and args[0][:1] == "-" and args[0][1:].isdigit():
+        count, args = int(args[0][1:]), args[1:]
+    source = _pipe_cat(args, None) if args else upstream
+    if source is None:
+        return
+    lines = _iter_lines(source)
+    try:
+        for _ in range(count):
+            line = next(lines, None)
+            if line is None:
+                break
+            yield line if line.endswith("\n") else line + "\n"
+    finally:
+        lines.close()
+        if args:
+            source.close()
+
+
+def _pipe_wc(args: list[str], upstream):
+    """wc [-l] [-w] [-c] [ФАЙЛ...]: строки, слова и байты"""
+    selected = [flag for flag in "lwc" if f"-{flag}" in args] or list("lwc")
+    names = [arg for arg in args if not arg.startswith('-')]
+    if names:
+        sources = []
+        for name in names:
+            _, entry = _resolve(name)
+            if not _is_file(entry):
+                print(f"wc: {name}: No such file or directory")
+                continue
+            sources.append((name, (bytes(chunk) for chunk in _iter_file_chunks(entry))))
+    elif upstream is not None:
+        sources = [(None, (chunk.encode('utf-8') for chunk in upstream))]
+    else:
+        return
+
+    for name, chunks in sources:
+        counts = {"l": 0, "w": 0, "c": 0}
+        in_word = False
+        for chunk in chunks:
+            counts["l"] += chunk.count(b"\n")
+            counts["c"] += len(chunk)
+            words = chunk.split()
+            counts["w"] += len(words)
+            # Слово, разрезанное границей блока, считается один раз
+            if words and in_word and not chunk[:1].isspace():
+                counts["w"] -= 1
+            in_word = bool(chunk) and not chunk[-1:].isspace()
+        line = " ".join(str(counts[flag]) for flag in selected)
+        yield f"{line} {name}\n" if name else line + "\n"
+
+
+# команды, которые в конвейере работают как потоковые стадии (остальные - через _command_stage)
+PIPE_STAGES = {
+    "cat": _pipe_cat,
+    "rev": _pipe_rev,
+    "grep": _pipe_grep,
+    "head": _pipe_head,
+    "wc": _pipe_wc,
+}
+
+
+def _redirect_target(path: str) -> tuple | None:
+    """Проверяет файл перенаправления до запуска команд: (компоненты, прежний файл или None)"""
+    parts, node = _resolve(path)
+    if not parts or isinstance(node, DirNode):
+        print(f"{path}: Is a directory")
+        return None
+    if not isinstance(_lookup_node(parts[:-1]), DirNode):
+        print(f"{path}: No such file or directory")
+        return None
+    return parts, node
+
+
+def _write_vfs_file(path: str, parts: tuple, chunks, old, append: bool) -> bool:
+    """Записывает вывод конвейера в файл VFS (в памяти; исходные архивы не меняются)"""
+    data = bytearray(bytes(_file_data(old)) if append and old is not None else b"")
+    for chunk in chunks:
+        data += chunk.encode('utf-8')
+
+    # Стадии конвейера могли изменить дерево: путь проверяется ещё раз
+    if not isinstance(_lookup_node(parts[:-1]), DirNode):
+        print(f"{path}: No such file or directory")
+        return False
+    parent = _ensure_dir(parts[:-1])
+    replaced = parent.children.get(parts[-1])
+    if isinstance(replaced, DirNode):
+        print(f"{path}: Is a directory")
+        return False
+    if replaced is not None:
+        _update_totals(parts[:-1], *(-value for value in _totals(replaced)))
+    entry = FileEntry(bytes(data))
+    parent.children[parts[-1]] = entry
+    _update_totals(parts[:-1], *_totals(entry))
+    _invalidate_paths()
+    return True
+
+
+def run_pipeline(stages: list[list[str]], target: str | None, append: bool) -> None:
+    """Выполняет конвейер: стадии - итераторы текстовых блоков, каждая читает предыдущую по мере надобности"""
+    if target is not None:
+        if not VFS["loaded"]:
+            print(VFS_NOT_LOADED)
+            return
+        checked = _redirect_target(target)
+        if checked is None:
+            return
+
+    iterators = []
+    upstream = None
+    for cmd, *args in stages:
+        stage = PIPE_STAGES.get(cmd) if VFS["loaded"] else None
+        upstream = stage(args, upstream) if stage else _command_stage(cmd, args)
+        iterators.append(upstream)
+    try:
+        if target is None:
+            for chunk in upstream:
+                sys.stdout.write(chunk)
+        else:
+            _write_vfs_file(target, checked[0], upstream, checked[1], append)
+    except (zipfile.BadZipFile, zlib.error) as e:
+        print(f"Ошибка чтения архива: {e}")
+    finally:
+        # Закрытие останавливает стадии, которые ещё могли бы производить вывод
+        for iterator in reversed(iterators):
+            iterator.close()
+
+
+def _run_locked(name: str, write: bool, action):
+    # Чтения VFS из разных сеансов идут параллельно, изменения - монопольно
+    lock = VFS_LOCK.write() if write else VFS_LOCK.read()
+    if not PROFILE["enabled"]:
+        with lock:
+            return action()
+
+    _PROFILE_TLS.touched = 0
+    started = time.perf_counter()
+    try:
+        with lock:
+            return action()
+    finally:
+        _record_command(name, time.perf_counter() - started, _PROFILE_TLS.touched)
 
 
 def execute_line(line: str) -> str | None:
     if line.startswith("$") or line.startswith("%") or line.lower().startswith("$env:"):
         line = "echo " + line
 
+    if '|' in line or '>' in line:
+        try:
+            segments, target, append = _split_pipeline(line)
+        except ValueError as e:
+            print(f"Ошибка парсера: {e}")
+            return None
+        if len(segments) > 1 or target is not None:
+            stages = [parse_command(segment) for segment in segments]
+            if not all(stages):
+                return None
+            if target is not None:
+                try:
+                    targets = shlex.split(target)
+                except ValueError as e:
+                    print(f"Ошибка парсера: {e}")
+                    return None
+                if len(targets) != 1:
+                    print("Ошибка парсера: после '>' ожидается одно имя файла")
+                    return None
+                target = _expand_exact_env_ref(targets[0])
+            write = target is not None or any(_is_write_command(stage[0]) for stage in stages)
+            _run_locked("pipeline", write, lambda: run_pipeline(stages, target, append))
+            return None
+
     parts = parse_command(line)
     if not parts:
         return None
 
     cmd, *args = parts
+    name = cmd if cmd in COMMANDS else PROFILE_UNKNOWN
+    return _run_locked(name, _is_write_command(cmd), lambda: _dispatch(cmd, args))
+
+
+def _percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def print_stats() -> None:
+    """Выводит время загрузки, размер VFS и задержки команд по перцентилям"""
+    load_seconds = PROFILE["load_seconds"]
+    print(f"Загрузка VFS: {load_seconds * 1000:.1f} мс" if load_seconds is not None else "Загрузка VFS: -")
+    files, folders = _count_nodes(VFS["root"])
+    print(f"Размер VFS: файлов {files}, папок {folders}")
+    print(f"Дедупликация: {VFS['dedup_files']} файлов, {VFS['dedup_bytes']} байт")
+    if not PROFILE["enabled"]:
+        print("Профилирование выключено (запустите с --profile)")
+        return
+
+    with _PROFILE_LOCK:
+        commands = {cmd: (sorted(record["times"]), record["touched"])
+                    for cmd, record in PROFILE["commands"].items()}
+    if not commands:
+        print("Команды ещё не выполнялись")
+        return
+    print(f"{'command':<10} {'calls':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total ms':>10} {'touched':>9}")
+    for cmd, (times, touched) in sorted(commands.items()):
+        print(f"{cmd:<10} {len(times):>7} {_percentile(times, 0.50) * 1000:>9.3f} "
+              f"{_percentile(times, 0.95) * 1000:>9.3f} {_percentile(times, 0.99) * 1000:>9.3f} "
+              f"{sum(times) * 1000:>10.2f} {touched:>9}")
+
+
+# реестр команд: имя -> {"handler": функция(args), "needs_vfs": bool, "write": bool}
+COMMANDS = {}
+
+VFS_NOT_LOADED = "VFS не загружена. Используйте -v путь_к_zip для загрузки."
+
+
+def command(*names: str, needs_vfs: bool = False, write: bool = False):
+    """Регистрирует обработчик команды; needs_vfs - нужна загруженная VFS, write - команда меняет VFS"""
+    def register(handler):
+        for name in names:
+            COMMANDS[name] = {"handler": handler, "needs_vfs": needs_vfs, "write": write}
+        return handler
+    return register
+
+
+def _is_write_command(cmd: str) -> bool:
+    # Команды, изменяющие VFS, выполняются под блокировкой на запись
+    spec = COMMANDS.get(cmd)
+    return spec is not None and spec["write"]
+
+
+@command("exit")
+def _cmd_exit(args: list[str]) -> str:
+    print("Выход.")
+    return "exit"
+
+
+@command("echo")
+def _cmd_echo(args: list[str]) -> None:
+    print(" ".join(args))
+
+
+@command("ls", needs_vfs=True)
+def _cmd_ls(args: list[str]) -> None:
+    if "-R" in args:
+        paths = [arg for arg in args if arg != "-R"] or ["."]
+        for i, path in enumerate(paths):
+            if i:
+                print()
+            list_recursive(path)
+    elif args:
+        for i, path in enumerate(args):
+            _, node = _resolve(path)
+            if node is None:
+                print(f"ls: cannot access '{path}': No such file or directory")
+                continue
+            if _is_file(node):
+                print(path)
+                continue
+            if len(args) > 1:
+                print(("\n" if i else "") + f"{path}:")
+            print("\n".join(list_vfs_directory(path) or ["Директория пуста"]))
+    else:
+        print("\n".join(list_vfs_directory() or ["Директория пуста"]))
 
-    if cmd == "exit":
-        print("Выход.")
-        return "exit"
 
-    elif cmd == "echo":
-        print(" ".join(args))
+@command("find", needs_vfs=True)
+def _cmd_find(args: list[str]) -> None:
+    find_entries(list(args))
 
-    elif cmd == "ls":
-        if not VFS["loaded"]:
-            print("VFS не загружена. Используйте -v путь_к_zip для загрузки.")
-        else:
-            files = list_vfs_directory()
-            if files:
-                for file in files:
-                    print(file)
-            else:
-                print("Директория пуста")
 
-    elif cmd == "cd":
-        if not VFS["loaded"]:
-            print("VFS не загружена. Используйте -v путь_к_zip для загрузки.")
-        else:
-            if args:
-                change_vfs_directory(args[0])
-            else:
-                VFS["cwd"] = "/"
+@command("du", needs_vfs=True)
+def _cmd_du(args: list[str]) -> None:
+    disk_usage(list(args))
 
-    elif cmd == "vfs-init":
-        vfs_init()
 
-    elif cmd == "pwd":
-        print(VFS["cwd"])
+@command("df", needs_vfs=True)
+def _cmd_df(args: list[str]) -> None:
+    disk_free()
 
-    elif cmd == "cat":
-        if not VFS["loaded"]:
-            print("VFS не загружена. Используйте -v путь_к_zip для загрузки.")
-        elif not args:
-            print("cat: missing operand")
-        else:
-            for filename in args:
-                cat_file(filename)
 
-    elif cmd == "rev":
-        if not VFS["loaded"]:
-            print("VFS не загружена. Используйте -v путь_к_zip для загрузки.")
-        elif not args:
-            print("rev: missing operand")
-        else:
-            for arg in args:
-                # Проверяем является ли аргумент файлом в VFS
-                abs_path = arg.lstrip('/')
-                if VFS["cwd"] != "/":
-                    abs_path = VFS["cwd"].lstrip('/') + arg
+@command("grep", needs_vfs=True)
+def _cmd_grep(args: list[str]) -> None:
+    grep_files(list(args))
 
-                abs_path = abs_path.rstrip('/')
 
-                if abs_path in VFS["files"]:
-                    # Если это файл - обрабатываем как файл
-                    rev_file(arg)
-                else:
-                    # Иначе обрабатываем как текст
-                    print(rev_text(arg))
+@command("cd", needs_vfs=True)
+def _cmd_cd(args: list[str]) -> None:
+    if args:
+        change_vfs_directory(args[0])
+    else:
+        _session()["cwd"] = "/"
 
-    elif cmd == "mv":
-        if not VFS["loaded"]:
-            print("VFS не загружена. Используйте -v путь_к_zip для загрузки.")
-        elif len(args) != 2:
-            print("mv: missing operand" if len(args) < 2 else "mv: too many arguments")
-        else:
-            move_file(args[0], args[1])
 
-    elif cmd == "rmdir":
-        if not VFS["loaded"]:
-            print("VFS не загружена. Используйте -v путь_к_zip для загрузки.")
-        elif not args:
-            print("rmdir: missing operand")
+@command("vfs-init", write=True)
+def _cmd_vfs_init(args: list[str]) -> None:
+    vfs_init()
+
+
+@command("mount", write=True)
+def _cmd_mount(args: list[str]) -> None:
+    if not args:
+        for layer in VFS["layers"]:
+            print(f"{layer['path']} on {layer['mount']}")
+    elif len(args) <= 2:
+        mount_archive(*args, use_mmap=CONFIG["mmap"], index_dir=CONFIG["index_dir"])
+    else:
+        print("Usage: mount [<zip_path> [mount_point]]")
+
+
+@command("vfs-save", needs_vfs=True)
+def _cmd_vfs_save(args: list[str]) -> None:
+    if len(args) != 1:
+        print("Usage: vfs-save <zip_path>")
+    else:
+        save_vfs_to_zip(args[0])
+
+
+_SNAPSHOT_USAGE = "Usage: snapshot [name] | restore <name> | diff <old> [new]"
+
+
+@command("snapshot", needs_vfs=True, write=True)
+def _cmd_snapshot(args: list[str]) -> None:
+    if not args:
+        for name in sorted(SNAPSHOTS):
+            print(name)
+    elif len(args) == 1:
+        take_snapshot(args[0])
+    else:
+        print(_SNAPSHOT_USAGE)
+
+
+@command("restore", needs_vfs=True, write=True)
+def _cmd_restore(args: list[str]) -> None:
+    if len(args) == 1:
+        restore_snapshot(args[0])
+    else:
+        print(_SNAPSHOT_USAGE)
+
+
+@command("diff", needs_vfs=True)
+def _cmd_diff(args: list[str]) -> None:
+    if len(args) in (1, 2):
+        diff_snapshots(*args)
+    else:
+        print(_SNAPSHOT_USAGE)
+
+
+@command("stats")
+def _cmd_stats(args: list[str]) -> None:
+    if args == ["reset"]:
+        with _PROFILE_LOCK:
+            PROFILE["commands"].clear()
+        print("Статистика команд сброшена")
+    else:
+        print_stats()
+
+
+@command("pwd")
+def _cmd_pwd(args: list[str]) -> None:
+    print(_session()["cwd"])
+
+
+@command("cat", needs_vfs=True)
+def _cmd_cat(args: list[str]) -> None:
+    if not args:
+        print("cat: missing operand")
+    for filename in args:
+        cat_file(filename)
+
+
+@command("rev", needs_vfs=True)
+def _cmd_rev(args: list[str]) -> None:
+    if not args:
+        print("rev: missing operand")
+    for arg in args:
+        # Проверяем является ли аргумент файлом в VFS
+        if _is_file(_resolve(arg)[1]):
+            # Если это файл - обрабатываем как файл
+            rev_file(arg)
         else:
-            for dirname in args:
-                remove_directory(dirname)
+            # Иначе обрабатываем как текст
+            print(rev_text(arg))
+
+
+def _stage_on_files(cmd: str, args: list[str]) -> None:
+    # head и wc вне конвейера читают файлы той же стадией, что и в конвейере
+    if not args:
+        print(f"{cmd}: без конвейера нужен файл")
+        return
+    for chunk in PIPE_STAGES[cmd](args, None):
+        sys.stdout.write(chunk)
 
+
+@command("head", needs_vfs=True)
+def _cmd_head(args: list[str]) -> None:
+    _stage_on_files("head", args)
+
+
+@command("wc", needs_vfs=True)
+def _cmd_wc(args: list[str]) -> None:
+    _stage_on_files("wc", args)
+
+
+@command("mv", needs_vfs=True, write=True)
+def _cmd_mv(args: list[str]) -> None:
+    if len(args) != 2:
+        print("mv: missing operand" if len(args) < 2 else "mv: too many arguments")
     else:
-        print(f"Неизвестная команда: {cmd}")
+        move_file(args[0], args[1])
 
-    return None
 
+@command("rmdir", needs_vfs=True, write=True)
+def _cmd_rmdir(args: list[str]) -> None:
+    if not args:
+        print("rmdir: missing operand")
+    for dirname in args:
+        remove_directory(dirname)
 
-def run_script(path: str) -> None:
+
+def _dispatch(cmd: str, args: list[str]) -> str | None:
+    spec = COMMANDS.get(cmd)
+    if spec is None:
+        print(f"Неизвестная команда: {cmd}")
+        return None
+    if spec["needs_vfs"] and not VFS["loaded"]:
+        print(VFS_NOT_LOADED)
+        return None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            for raw in f:
-                line = raw.rstrip("\n")
-                stripped = line.strip()
+        return spec["handler"](args)
+    except (zipfile.BadZipFile, zlib.error) as e:
+        # Повреждённый элемент архива (например, неверный CRC) обнаруживается только при чтении
+        print(f"{cmd}: ошибка чтения архива: {e}")
+        return None
 
-                if stripped.startswith("#") or stripped == "":
-                    print(line)
-                    continue
 
-                print(make_prompt() + line)
-                status = execute_line(line)
-                if status == "exit":
-                    return
+class _BlockOutput:
+    """Блочно-буферизованный вывод: строки копятся в памяти и уходят в поток крупными блоками"""
+
+    def __init__(self, stream, block_size: int = OUTPUT_BLOCK):
+        self.stream = stream
+        self.block_size = block_size
+        self._parts = []
+        self._size = 0
+
+    def write(self, text: str) -> int:
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.block_size:
+            self._drain()
+        return len(text)
+
+    def _drain(self) -> None:
+        if self._parts:
+            self.stream.write("".join(self._parts))
+            self._parts, self._size = [], 0
+
+    def flush(self) -> None:
+        self._drain()
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _run_script_lines(lines, echo: bool) -> None:
+    for raw in lines:
+        line = raw.rstrip("\n")
+        stripped = line.strip()
+
+        if stripped.startswith("#") or stripped == "":
+            print(line)
+            continue
+
+        if echo:
+            print(make_prompt() + line)
+        status = execute_line(line)
+        if status == "exit":
+            sys.stdout.flush()
+            return
+
+
+def run_script(path: str, echo: bool = True) -> None:
+    """Выполняет команды из файла; путь '-' - команды читаются из stdin по мере поступления"""
+    try:
+        if path == "-":
+            _run_script_lines(sys.stdin, echo)
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            _run_script_lines(f, echo)
     except FileNotFoundError:
         print(f"Ошибка: стартовый скрипт не найден: {path}")
     except UnicodeDecodeError:
@@ -539,6 +2793,132 @@ def repl():
             break
 
 
+class _SessionStdout:
+    """Замена sys.stdout в режиме сервера: вывод уходит в поток текущего сеанса"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def _target(self):
+        return _session()["out"] or self.fallback
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+class _SocketOutput:
+    """Поток вывода сеанса: текст из рабочего потока передаётся в сокет через цикл событий"""
+
+    def __init__(self, loop, writer):
+        self._loop = loop
+        self._writer = writer
+        self._pending = 0
+        # клиент отключился или перестал читать вывод
+        self.closed = False
+
+    def write(self, text: str) -> int:
+        if self.closed:
+            raise BrokenPipeError("клиент сеанса не принимает вывод")
+        if text:
+            data = text.encode('utf-8')
+            self._loop.call_soon_threadsafe(self._writer.write, data)
+            self._pending += len(data)
+            if self._pending >= CHUNK_SIZE:
+                self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        # Ждём, пока сокет примет данные: вывод большого файла не копится в памяти.
+        # Команда при этом держит VFS_LOCK, поэтому ожидание ограничено: клиент, который
+        # перестал читать, отключается, а команда прерывается BrokenPipeError
+        if self.closed:
+            return
+        self._pending = 0
+        drained = asyncio.run_coroutine_threadsafe(self._writer.drain(), self._loop)
+        try:
+            drained.result(timeout=SESSION_DRAIN_TIMEOUT)
+        except Exception as e:
+            drained.cancel()
+            self.closed = True
+            self._loop.call_soon_threadsafe(self._writer.transport.abort)
+            raise BrokenPipeError("клиент сеанса не принимает вывод") from e
+
+
+def _run_session_line(line: str) -> str | None:
+    """Выполняет строку сеанса в рабочем потоке; ошибка команды не роняет сервер"""
+    out = _session()["out"]
+    try:
+        status = execute_line(line)
+    except Exception as e:
+        if out.closed:
+            return "exit"
+        print(f"Ошибка выполнения команды: {e}")
+        status = None
+    try:
+        out.flush()
+    except BrokenPipeError:
+        return "exit"
+    # Команда могла сама перехватить ошибку записи: сеанс всё равно закрывается
+    return "exit" if out.closed else status
+
+
+async def _serve_session(reader, writer) -> None:
+    session = {"cwd": "/", "out": _SocketOutput(asyncio.get_running_loop(), writer)}
+    SESSIONS[id(session)] = session
+    # Контекст задачи копируется в рабочие потоки вместе с текущим сеансом
+    SESSION.set(session)
+    try:
+        writer.write("Эмулятор запущен. Введите 'exit' для выхода.\n".encode('utf-8'))
+        while True:
+            writer.write(make_prompt().encode('utf-8'))
+            await writer.drain()
+            raw = await reader.readline()
+            if not raw:
+                break
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            if await asyncio.to_thread(_run_session_line, line) == "exit":
+                break
+    except ConnectionError:
+        pass
+    finally:
+        SESSIONS.pop(id(session), None)
+        writer.close()
+
+
+async def _serve(address: str) -> None:
+    if address.startswith("unix:"):
+        server = await asyncio.start_unix_server(_serve_session, path=address[len("unix:"):])
+    else:
+        host, _, port = address.rpartition(':')
+        server = await asyncio.start_server(_serve_session, host or "127.0.0.1", int(port))
+    print(f"Сервер VFS слушает: {address}")
+    sys.stdout.flush()
+    async with server:
+        await server.serve_forever()
+
+
+def serve(address: str) -> None:
+    """Обслуживает параллельные сеансы оболочки над общей VFS (host:port или unix:путь)"""
+    sys.stdout = _SessionStdout(sys.stdout)
+    try:
+        asyncio.run(_serve(address))
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    except (OSError, ValueError, AttributeError) as e:
+        # AttributeError: Unix-сокеты недоступны на этой платформе
+        print(f"Ошибка запуска сервера: {e}")
+    finally:
+        sys.stdout = sys.stdout.fallback
+
+
 def _abspath_or_none(p: str | None) -> str | None:
     if not p:
         return None
@@ -547,9 +2927,35 @@ def _abspath_or_none(p: str | None) -> str | None:
 
 def parse_cli_args():
     parser = argparse.ArgumentParser(description="Эмулятор оболочки — Этап 5: Дополнительные команды")
-    parser.add_argument("-v", "--vfs", dest="vfs_root", help="Путь к ZIP-архиву с VFS", default=None)
-    parser.add_argument("-s", "--script", dest="startup_script", help="Путь к стартовому скрипту", default=None)
+    parser.add_argument("-v", "--vfs", dest="vfs_root", nargs="+", action="extend", default=None,
+                        help="Путь к ZIP-архиву с VFS; следующие архивы монтируются поверх него (overlay)")
+    parser.add_argument("-s", "--script", dest="startup_script", default=None,
+                        help="Путь к стартовому скрипту ('-' - читать команды из stdin)")
     parser.add_argument("--no-interactive", action="store_true", help="Не входить в REPL")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Читать только метаданные ZIP, распаковывать файлы по требованию")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Отобразить архив в память: несжатые файлы читаются без копирования")
+    parser.add_argument("--load-jobs", dest="load_jobs", type=int, default=CONFIG["load_jobs"],
+                        help="Число потоков для распаковки архива при полной загрузке")
+    parser.add_argument("--index-cache", dest="index_dir", nargs="?", const="", default=None,
+                        help="Кэшировать структуру архива на диске (по умолчанию в ~/.cache/vfs-emulator)")
+    parser.add_argument("--cache-mb", dest="cache_mb", type=int, default=CONFIG["cache_mb"],
+                        help="Бюджет кэша распакованного содержимого в ленивом режиме, МБ")
+    parser.add_argument("--serve", dest="serve", default=None, metavar="ADDR",
+                        help="Режим сервера: сеансы по TCP (host:port) или Unix-сокету (unix:путь)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Замерять время и число затронутых элементов VFS для каждой команды (см. stats)")
+    parser.add_argument("--grep-jobs", dest="grep_jobs", type=int, default=CONFIG["grep_jobs"],
+                        help="Число потоков grep для распаковки и поиска по ещё не распакованным файлам")
+    parser.add_argument("--grep-index", action="store_true",
+                        help="Отбирать файлы для grep по триграммному индексу (строится при первом поиске)")
+    parser.add_argument("--save-on-exit", dest="save_on_exit", default=None, metavar="ZIP",
+                        help="При выходе сохранить дерево VFS (с изменениями mv/rmdir) в новый ZIP-архив")
+    parser.add_argument("--batch", action="store_true",
+                        help="Пакетный режим: без эха приглашения, вывод блоками; без -s команды читаются из stdin")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Не выводить отладочные параметры запуска")
     return parser.parse_args()
 
 
@@ -557,29 +2963,87 @@ def print_debug_config():
     print("=== DEBUG: параметры запуска ===")
     print(f"OS: {os.name}, Python: {sys.version.split()[0]}")
     print(f"VFS root:       {CONFIG['vfs_root'] or '(не задан)'}")
+    if CONFIG["vfs_overlays"]:
+        print(f"VFS overlays:   {', '.join(CONFIG['vfs_overlays'])}")
     print(f"Startup script: {CONFIG['startup_script'] or '(не задан)'}")
     print(f"Interactive:    {not CONFIG['no_interactive']}")
+    print(f"Lazy load:      {CONFIG['lazy']} (cache {CONFIG['cache_mb']} MB)")
+    print(f"Mmap archive:   {CONFIG['mmap']}")
+    print(f"Load jobs:      {CONFIG['load_jobs']}")
+    print(f"Index cache:    {CONFIG['index_dir'] or '(выключен)'}")
+    print(f"Profile:        {CONFIG['profile']}")
+    print(f"Grep:           jobs {CONFIG['grep_jobs']}, index {CONFIG['grep_index']}")
+    if CONFIG["serve"]:
+        print(f"Serve:          {CONFIG['serve']}")
+    if CONFIG["save_on_exit"]:
+        print(f"Save on exit:   {CONFIG['save_on_exit']}")
+    if CONFIG["batch"]:
+        print("Batch:          True")
     print("===============================")
 
 
 def main():
     args = parse_cli_args()
-    CONFIG["vfs_root"] = _abspath_or_none(args.vfs_root)
-    CONFIG["startup_script"] = _abspath_or_none(args.startup_script)
-    CONFIG["no_interactive"] = bool(args.no_interactive)
+    vfs_paths = [_abspath_or_none(path) for path in args.vfs_root or []]
+    CONFIG["vfs_root"] = vfs_paths[0] if vfs_paths else None
+    CONFIG["vfs_overlays"] = vfs_paths[1:]
+    CONFIG["batch"] = bool(args.batch)
+    CONFIG["quiet"] = bool(args.quiet)
+    if args.startup_script == "-" or (CONFIG["batch"] and not args.startup_script):
+        CONFIG["startup_script"] = "-"
+    else:
+        CONFIG["startup_script"] = _abspath_or_none(args.startup_script)
+    # В пакетном режиме REPL не запускается
+    CONFIG["no_interactive"] = bool(args.no_interactive) or CONFIG["batch"]
+    CONFIG["lazy"] = bool(args.lazy)
+    CONFIG["cache_mb"] = max(0, args.cache_mb)
+    CONFIG["mmap"] = bool(args.mmap)
+    CONFIG["load_jobs"] = max(1, args.load_jobs)
+    if args.index_dir is not None:
+        CONFIG["index_dir"] = _abspath_or_none(args.index_dir) or _default_index_dir()
+    CONFIG["serve"] = args.serve
+    CONFIG["profile"] = bool(args.profile)
+    CONFIG["grep_jobs"] = max(1, args.grep_jobs)
+    CONFIG["grep_index"] = bool(args.grep_index)
+    CONFIG["save_on_exit"] = _abspath_or_none(args.save_on_exit)
+    PROFILE["enabled"] = CONFIG["profile"]
+    CONTENT_CACHE.max_bytes = CONFIG["cache_mb"] * 1024 * 1024
+
+    # Конвейеры оборачивают sys.stdout в _SessionStdout, поэтому буфер сбрасывается по своей ссылке
+    block_output = _BlockOutput(sys.stdout) if CONFIG["batch"] else None
+    if block_output is not None:
+        stdout, sys.stdout = sys.stdout, block_output
+    try:
+        run_session()
+    finally:
+        if block_output is not None:
+            block_output.flush()
+            sys.stdout = stdout
 
-    print_debug_config()
+
+def run_session() -> None:
+    """Загружает VFS и выполняет стартовый скрипт, REPL или сервер согласно CONFIG"""
+    if not CONFIG["quiet"]:
+        print_debug_config()
 
     if CONFIG["vfs_root"]:
-        if not load_vfs_from_zip(CONFIG["vfs_root"]):
+        if not load_vfs_from_zip(CONFIG["vfs_root"], lazy=CONFIG["lazy"], use_mmap=CONFIG["mmap"],
+                                 jobs=CONFIG["load_jobs"], index_dir=CONFIG["index_dir"]):
             print("Не удалось загрузить VFS")
+        for overlay in CONFIG["vfs_overlays"]:
+            mount_archive(overlay, use_mmap=CONFIG["mmap"], index_dir=CONFIG["index_dir"])
 
     if CONFIG["startup_script"]:
-        run_script(CONFIG["startup_script"])
+        run_script(CONFIG["startup_script"], echo=not CONFIG["batch"])
 
-    if not CONFIG["no_interactive"]:
+    if CONFIG["serve"]:
+        serve(CONFIG["serve"])
+    elif not CONFIG["no_interactive"]:
         repl()
 
+    if CONFIG["save_on_exit"] and VFS["loaded"]:
+        save_vfs_to_zip(CONFIG["save_on_exit"])
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file